@@ -2,7 +2,7 @@
  File to define the handler to validate de JWT sent by the request
 """
 # pylint: disable=import-error
-from integrations.keycloak.keycloak import Keycloak
+from integrations.keycloak.keycloak import Keycloak, log_session_cache_stats
 from utils.logger_config import setup_logger
 
 logger = setup_logger(__name__)
@@ -22,6 +22,7 @@ def authorizer(event, context):  # pylint: disable=unused-argument
     logger.debug("GENERAL Method ARN: %s", general_arn)
     keycloak = Keycloak(external_token = token)
     user_id = keycloak.validate_session()
+    log_session_cache_stats()
     if user_id:
         logger.info("Session validated for user ID: %s", user_id)
         policy = generate_allow_policy(general_arn, user_id)
@@ -1,12 +1,20 @@
 from helpers.authentication.auth_factory import SOAPAuthenticationFactory, ChecksAuthenticationFactory
 from helpers.authentication.auth_decorator import auth_decorator
+from helpers.soap_client.client import prewarm_from_environment
+from helpers.soap_client.exceptions import BackendUnavailableError
 
 from utils import utils_format
 from utils.logger_config import setup_logger
-from integrations.legacy.front_office_service.legacy_client import LegacyFactory, soap_serializer
+from integrations.legacy.front_office_service.legacy_client import LegacyFactory
+from integrations.legacy.front_office_service.response_cache import register_cacheable
 
 logger = setup_logger(__name__)
 
+# Runs during the lambda init so the first request does not pay the WSDL parsing
+prewarm_from_environment()
+# Unexpected responses are returned as null and must not be shared through the cache
+register_cacheable('GetGlobalAttribute', lambda value: isinstance(value, list))
+
 
 class LegacySettings:
     """Class with methods to get payeer information."""
@@ -28,14 +36,13 @@ class LegacySettings:
             body (dict) : Parameters for the compliance KYC rules. For details on the expected
                     format and keys, refer to the 'complience-kyc-rules' endpoint in Stoplight.
         Returns:
-            list: A list of dictionaries representing relationships for customer compliance. If
+            list: A list of dictionaries, with camel case keys and JSON ready values,
+                representing relationships for customer compliance. If
                 an unexpected response is received from the Hermes 1 service, this function
                 logs the error and returns None.
         """
         logger.info("****Settings.get_global_attributes()****")
-        global_attributes = soap_serializer(
-            self.client.service.GetGlobalAttribute(self.user_session)
-        )
+        global_attributes = self.legacy_client.call('GetGlobalAttribute')
 
         if isinstance(global_attributes, list):
             return global_attributes
@@ -58,18 +65,24 @@ def test(credentials, event, context):
     - dict: A formatted response containing HTTP status, result, and a message.
     """
 
-    _, _ = context, event
-    message, code_http, result = '', 0, None
+    _ = context
+    message, code_http, result, version = '', 0, None, None
     logger.info("Request to get global attributes")
     try:
         setting = LegacySettings(credentials=credentials)
+        # Read before the data, a response reloaded in between gets a new ETag on the next request
+        version = setting.legacy_client.response_version('GetGlobalAttribute')
         result = setting.get_global_attributes()
         code_http = 200
     except KeyError as missing_key:
         logger.error("Missing key in request parameters: %s", missing_key)
         code_http = 400
+    except BackendUnavailableError:
+        raise
     except Exception as internal_error: #pylint: disable=broad-except
         logger.error("Error to get the url. ERROR: %s", internal_error)
         code_http = 500
-    response = utils_format.return_formatted_response(None, code_http, result, message, use_camel_case=True)
+    response = utils_format.return_formatted_response(
+        None, code_http, result, message, event=event, etag_version=version
+    )
     return response
\ No newline at end of file
@@ -0,0 +1,19 @@
+"""
+ File to define the handler that keeps the session lookup table in sync with the users-sessions
+ table, triggered by the DynamoDB stream of the users-sessions table
+"""
+# pylint: disable=import-error
+from helpers.authentication.session_lookup_migration import sync_session_lookup_records
+from utils.logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def handler(event, context):  # pylint: disable=unused-argument
+    """
+        Copies the sessions created, changed or removed in the users-sessions table to the
+        SESSION_LOOKUP_TABLE read by the get_item lookup mode
+    """
+    records = event.get('Records', [])
+    logger.info("Synchronizing %s session records", len(records))
+    return {'synchronized': sync_session_lookup_records(records)}
@@ -4,21 +4,34 @@ This module provides a decorator for handling authentication.
 # pylint: disable=line-too-long
 from utils.utils_format import return_formatted_response
 from utils.logger_config import setup_logger
+from helpers.soap_client.exceptions import BackendUnavailableError
+from .auth_factory import CompositeAuthenticationFactory
 
 logger = setup_logger(__name__)
 
-def auth_decorator(auth_factory):
+def auth_decorator(*auth_factories):
     """
     A decorator that fetches user credentials using the provided authentication factory and 
     injects them into the wrapped function.
 
+    When several factories are given their credentials are resolved with a single session lookup
+    and injected as a tuple, in the same order.
+
+    A BackendUnavailableError raised by the function, like an open circuit (503) or a saturated
+    concurrency limit (429) of a SOAP backend, is answered with its status code and a Retry-After
+    header.
+
     Parameters:
-        auth_factory (AuthenticationFactory): An instance of AuthenticationFactory to use for fetching user credentials.
+        auth_factories (AuthenticationFactory): One or more instances of AuthenticationFactory to use for fetching user credentials.
 
     Returns:
         inner_decorator (function): A function that wraps the original function.
     """
     logger.info("****auth_decorator()****")
+    if len(auth_factories) == 1:
+        auth_factory = auth_factories[0]
+    else:
+        auth_factory = CompositeAuthenticationFactory(*auth_factories)
     def inner_decorator(lambda_function):
         """
         A function that wraps the original function, injecting user credentials.
@@ -42,15 +55,8 @@ def auth_decorator(auth_factory):
                 result: The result of calling the original function with the injected credentials.
             """
             logger.info("****wrapper()****")
-            user_id = None
-            try:
-                if 'requestContext' in event:
-                    user_id = event['requestContext']['authorizer']['keycloak_user_id']
-                #for step functions
-                elif 'auth' in event:
-                    user_id = event['auth']['requestContext']['authorizer']['keycloak_user_id']
-            except (KeyError, TypeError):
-                user_id = None
+            authorizer_context = get_authorizer_context(event)
+            user_id = authorizer_context.get('keycloak_user_id')
             try:
                 credentials = auth_factory.get_credentials(user_id)
             except KeyError as err:
@@ -63,6 +69,33 @@ def auth_decorator(auth_factory):
                 code_http = 401
                 response = return_formatted_response(None, code_http, {}, str(err))
                 return response
-            return lambda_function(credentials, event, context)
+            try:
+                return lambda_function(credentials, event, context)
+            except BackendUnavailableError as err:
+                logger.error(err)
+                response = return_formatted_response(None, err.status_code, {}, str(err))
+                response['headers']['Retry-After'] = str(max(int(err.retry_after), 1))
+                return response
         return wrapper
     return inner_decorator
+
+
+def get_authorizer_context(event) -> dict:
+    """
+    Returns the context the API Gateway authorizer attached to the request.
+
+    Parameters:
+        event (dict): The event data, from API Gateway or from step functions.
+
+    Returns:
+        dict: The authorizer context, empty when the event does not have one.
+    """
+    try:
+        if 'requestContext' in event:
+            return event['requestContext']['authorizer'] or {}
+        #for step functions
+        if 'auth' in event:
+            return event['auth']['requestContext']['authorizer'] or {}
+    except (KeyError, TypeError):
+        pass
+    return {}
@@ -3,33 +3,224 @@ This module defines authentication strategies that interact with DynamoDB.
 """
 # pylint: disable=line-too-long
 
+import threading
 from datetime import datetime, timezone
 from abc import abstractmethod
 from dateutil import parser
 
+from utils.utils_aws import get_configuration
 from utils.utils_format import get_current_time_utc
+from utils.utils_singleflight import SingleFlight
 from utils.logger_config import setup_logger
 from .auth_stretagy import AuthenticationStrategy
 
 import boto3
+from boto3.dynamodb.conditions import Key
 
 logger = setup_logger(__name__)
 
-try:
-    ssm = boto3.client('ssm')
-    parameter = ssm.get_parameter(Name='/dynamo/users-sessions', WithDecryption=True)
-    NAME_DYNAMO_USER_SESSION_TABLE = parameter['Parameter']['Value']
-    dynamodb = boto3.resource('dynamodb')
-    DYNAMO_TABLE_USSER_SESSION = dynamodb.Table(NAME_DYNAMO_USER_SESSION_TABLE)
-except boto3.exceptions.botocore.exceptions.ClientError as error:
-    logger.error(str(error))
-    raise PermissionError(error) from error
+__SESSION_TABLE = None
+__SESSION_LOOKUP_TABLE = None
+__SESSION_TABLE_LOCK = threading.Lock()
+
+# Concurrent lookups of the same session and projection share one DynamoDB request
+SESSION_FLIGHTS = SingleFlight()
+
+
+def get_session_table():
+    """
+    Returns the users-sessions table, resolving its name from SSM the first time it is needed
+    instead of at import, so handlers that never read it do not pay for it during init.
+
+    Returns:
+        boto3 Table: The users-sessions table.
+
+    Raises:
+        PermissionError: When the table name could not be read from SSM.
+    """
+    global __SESSION_TABLE  # pylint: disable=global-statement
+    if __SESSION_TABLE is None:
+        with __SESSION_TABLE_LOCK:
+            if __SESSION_TABLE is None:
+                logger.info("****get_session_table()****")
+                try:
+                    ssm = boto3.client('ssm')
+                    parameter = ssm.get_parameter(Name='/dynamo/users-sessions', WithDecryption=True)
+                    dynamodb = boto3.resource('dynamodb')
+                    __SESSION_TABLE = dynamodb.Table(parameter['Parameter']['Value'])
+                except boto3.exceptions.botocore.exceptions.ClientError as error:
+                    logger.error(str(error))
+                    raise PermissionError(error) from error
+    return __SESSION_TABLE
+
+
+def get_session_lookup_table():
+    """
+    Returns the table keyed by keycloakId used by the `get_item` lookup mode
+    (`SESSION_LOOKUP_TABLE`), created on first use.
+
+    Returns:
+        boto3 Table: The lookup table.
+    """
+    global __SESSION_LOOKUP_TABLE  # pylint: disable=global-statement
+    if __SESSION_LOOKUP_TABLE is None:
+        with __SESSION_TABLE_LOCK:
+            if __SESSION_LOOKUP_TABLE is None:
+                __SESSION_LOOKUP_TABLE = boto3.resource('dynamodb').Table(get_configuration().session_lookup_table)
+    return __SESSION_LOOKUP_TABLE
+
+
+def __getattr__(name):
+    """Keeps the module level names of the table for the modules that import them"""
+    if name == 'DYNAMO_TABLE_USSER_SESSION':
+        return get_session_table()
+    if name == 'NAME_DYNAMO_USER_SESSION_TABLE':
+        return get_session_table().name
+    raise AttributeError(f"module {__name__} has no attribute {name}")
+
+def get_session_item(user_id, attributes = None) -> dict:
+    """
+    Retrieve the session record of the user from the DynamoDB table based on their keycloak_user_id.
+
+    With `SESSION_LOOKUP_MODE=get_item` the record is read with a GetItem (strongly consistent when
+    `SESSION_LOOKUP_CONSISTENT_READ` is enabled) from the table keyed by keycloakId, kept in sync
+    by `session_lookup_migration.sync_session_lookup_records`, falling back to the
+    `keycloakIdIndex` query when the record has not been copied there yet. The query returns the
+    newest record by DateOfCreation, the same one the lookup table keeps: read with
+    `ScanIndexForward=False, Limit=1` when `SESSION_INDEX_SORTED_BY_CREATION` tells the index sort
+    key orders the records by creation, otherwise picked from the first page of the query.
+    Concurrent lookups of the same user and attributes share one request.
+
+    Parameters:
+        user_id (str): The keycloak id saved in dynamo.
+        attributes (iterable, optional): Only these attributes are returned when provided.
+
+    Returns:
+        item (dict): The session record.
+
+    Raises:
+        KeyError: When no user is found for the provided id.
+    """
+    logger.info("****get_session_item()****")
+    keycloak_user_id = str(user_id)
+    flight_key = (keycloak_user_id, frozenset(attributes) if attributes else None)
+    return SESSION_FLIGHTS.do(flight_key, _read_session_item, keycloak_user_id, attributes)
+
+
+def _read_session_item(keycloak_user_id: str, attributes = None) -> dict:
+    config = get_configuration()
+    if config.session_lookup_mode == 'get_item':
+        response = get_session_lookup_table().get_item(
+            Key={'keycloakId': keycloak_user_id},
+            ConsistentRead=config.session_lookup_consistent_read,
+            **projection_arguments(attributes)
+        )
+        if 'Item' in response:
+            return response['Item']
+        if not config.session_lookup_fallback:
+            raise KeyError(": No user for id: "+ keycloak_user_id)
+        logger.warning("Session of %s not found in the lookup table, querying the index", keycloak_user_id)
+    if config.session_index_sorted_by_creation:
+        # The index sort key orders the records by creation, the newest is the first one backwards
+        query_arguments = {'ScanIndexForward': False, 'Limit': 1, **projection_arguments(attributes)}
+    else:
+        # A single page, as many records as the baseline query read, the newest of it is returned
+        query_arguments = projection_arguments(set(attributes) | {'DateOfCreation'} if attributes else None)
+    response = get_session_table().query(
+        IndexName='keycloakIdIndex',
+        KeyConditionExpression=Key('keycloakId').eq(keycloak_user_id),
+        **query_arguments
+    )
+    item = latest_session_item(response.get('Items', []))
+    if item is None:
+        logger.error("No session record for %s", keycloak_user_id)
+        raise KeyError(": No user for id: "+ keycloak_user_id)
+    return item
+
+
+def session_creation_time(item: dict):
+    """
+    Returns the DateOfCreation of a session record as datetime, None when it is missing or invalid.
+
+    Parameters:
+        item (dict): The session record.
+    """
+    try:
+        return parser.parse(item['DateOfCreation'])
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return None
+
+
+def is_newer_session(item: dict, current: dict) -> bool:
+    """
+    Tells whether a session record was created after another one, records without a valid
+    DateOfCreation are never newer.
+
+    Parameters:
+        item (dict): The candidate record.
+        current (dict): The record it is compared with, may be None.
+
+    Returns:
+        bool: True when `item` replaces `current`.
+    """
+    if current is None:
+        return True
+    item_time, current_time = session_creation_time(item), session_creation_time(current)
+    if item_time is None:
+        return False
+    try:
+        return current_time is None or item_time > current_time
+    except TypeError:
+        return False
+
+
+def latest_session_item(items) -> dict:
+    """
+    Returns the newest session record by DateOfCreation.
+
+    Parameters:
+        items (iterable): Session records of one user.
+
+    Returns:
+        dict: The newest record, None when there are none.
+    """
+    latest = None
+    for item in items:
+        if is_newer_session(item, latest):
+            latest = item
+    return latest
+
+
+def projection_arguments(attributes = None) -> dict:
+    """
+    Builds the ProjectionExpression arguments to read only some attributes of an item.
+    Names are always aliased so reserved words can be projected.
+
+    Parameters:
+        attributes (iterable, optional): Names of the attributes, all of them when None.
+
+    Returns:
+        dict: Keyword arguments for `query`/`get_item`.
+    """
+    if not attributes:
+        return {}
+    names = {f'#a{index}': attribute for index, attribute in enumerate(sorted(set(attributes)))}
+    return {
+        'ProjectionExpression': ', '.join(names),
+        'ExpressionAttributeNames': names
+    }
+
 
 class DynamoDBAuthStrategy(AuthenticationStrategy):
     """
     This strategy retrieves user credentials from a DynamoDB table.
+
+    Attributes:
+        REQUIRED_ATTRIBUTES (tuple): Attributes of the session record read by `parse_credentials`.
     """
 
+    REQUIRED_ATTRIBUTES = ()
+
     def get_credentials(self, user_id):
         """
         Retrieve the user's credentials from a DynamoDB table based on their keycloak_user_id.
@@ -46,17 +237,47 @@ class DynamoDBAuthStrategy(AuthenticationStrategy):
         """
         logger.info("****get_credentials()****")
         logger.info("Getting credentials for user: %s", user_id)
-        keycloak_user_id = str(user_id)
-        response = DYNAMO_TABLE_USSER_SESSION.query(
-            IndexName='keycloakIdIndex',
-            KeyConditionExpression=boto3.dynamodb.conditions.Key('keycloakId').eq(keycloak_user_id)
-        )
-        try:
-            item = response['Items'][0]
-            return self.parse_credentials(item)
-        except IndexError as err:
-            logger.error(err)
-            raise KeyError(": No user for id: "+ keycloak_user_id) from err
+        return self.parse_credentials(get_session_item(user_id, self.REQUIRED_ATTRIBUTES))
+
+    def get_credentials_with_expiration(self, user_id):
+        """
+        Retrieve the user's credentials and their expiration from the DynamoDB table.
+
+        Parameters:
+            user_id (str): The keycloak id saved in dynamo.
+
+        Returns:
+            tuple: The parsed credentials and their expiration epoch, None when it is unknown.
+
+        Raises:
+            KeyError: When no user is found for the provided id.
+        """
+        logger.info("****get_credentials_with_expiration()****")
+        item = get_session_item(user_id, self.REQUIRED_ATTRIBUTES)
+        return self.parse_credentials(item), self.credentials_expiration(item)
+
+    def credentials_expiration(self, credentials: dict):
+        """
+        Returns the epoch when the raw credentials expire, None when the record does not tell it.
+
+        Parameters:
+            credentials (dict): The raw credentials data.
+        """
+        _ = credentials
+        return None
+
+    def get_session_item(self, user_id, attributes = None):
+        """
+        Retrieve the session record of the user, used to read it once for several strategies.
+
+        Parameters:
+            user_id (str): The keycloak id saved in dynamo.
+            attributes (iterable, optional): Only these attributes are returned when provided.
+
+        Returns:
+            item (dict): The session record.
+        """
+        return get_session_item(user_id, attributes)
 
     @abstractmethod
     def parse_credentials(self, credentials: dict):
@@ -77,6 +298,8 @@ class RESTAuthStrategy(DynamoDBAuthStrategy):
     This strategy retrieves user credentials from a DynamoDB table and parses them for a REST interface.
     """
 
+    REQUIRED_ATTRIBUTES = ('gtwToken', 'gtwexpires')
+
     def parse_credentials(self, credentials:dict):
         """
         Parses the raw credentials retrieved from DynamoDB for a REST interface.
@@ -98,12 +321,23 @@ class RESTAuthStrategy(DynamoDBAuthStrategy):
             raise PermissionError(": Token Expired")
         return token
 
+    def credentials_expiration(self, credentials: dict):
+        """
+        Returns the epoch when the REST token expires.
+
+        Parameters:
+            credentials (dict): The raw credentials data.
+        """
+        return int(credentials['gtwexpires'])
+
 
 class SOAPAuthStrategy(DynamoDBAuthStrategy):
     """
     This strategy retrieves user credentials from a DynamoDB table and parses them for a SOAP interface.
     """
 
+    REQUIRED_ATTRIBUTES = ('soapLastChange', 'DateOfCreation', 'soapUserId', 'soapSessionGuid', 'Culture', 'IP')
+
     def parse_credentials(self, credentials):
         """
         Parses the raw credentials retrieved from DynamoDB for a SOAP interface.
@@ -144,6 +378,11 @@ class ChecksAuthStrategy(DynamoDBAuthStrategy):
     """
     This strategy retrieves user credentials from a DynamoDB table and parses them for a Checks interface.
     """
+
+    REQUIRED_ATTRIBUTES = (
+        'tokenAccessCheck', 'soapUserId', 'Culture', 'soapSessionGuid', 'username', 'pcName', 'pcIdentifier', 'pcSerial'
+    )
+
     def parse_credentials(self, credentials:dict):
         """
         Parses the raw credentials retrieved from DynamoDB for a Checks interface.
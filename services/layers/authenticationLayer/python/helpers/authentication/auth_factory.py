@@ -3,18 +3,62 @@ This module implements a factory pattern for creating authentication strategies.
 """
 # pylint: disable=line-too-long
 
+import importlib
+import time
 from abc import ABC, abstractmethod
+from utils.utils_aws import get_configuration
+from utils.utils_cache import TTLCache, MISSING
 from utils.logger_config import setup_logger
-from .auth_dynamo_credentials import SOAPAuthStrategy, RESTAuthStrategy, ChecksAuthStrategy
-from .auth_env_variables import ESAuthStrategy, ReportingAuthStrategy, FileStorageAtuhStrategy
 
 logger = setup_logger(__name__)
 
+# Strategies are imported the first time they are used, so env-only factories never load the
+# DynamoDB module and its dependencies during init.
+STRATEGY_REGISTRY = {
+    'SOAPAuthStrategy':         '.auth_dynamo_credentials',
+    'RESTAuthStrategy':         '.auth_dynamo_credentials',
+    'ChecksAuthStrategy':       '.auth_dynamo_credentials',
+    'ESAuthStrategy':           '.auth_env_variables',
+    'ReportingAuthStrategy':    '.auth_env_variables',
+    'FileStorageAtuhStrategy':  '.auth_env_variables',
+}
+
+
+def load_strategy(name: str):
+    """
+    Imports the module of a registered strategy and returns its class.
+
+    Parameters:
+        name (str): The class name of the strategy.
+
+    Returns:
+        type: The AuthenticationStrategy subclass.
+    """
+    module = importlib.import_module(STRATEGY_REGISTRY[name], __package__)
+    return getattr(module, name)
+
+CREDENTIALS_CACHE = TTLCache(
+    maxsize=get_configuration().credentials_cache_size,
+    ttl=get_configuration().credentials_cache_ttl
+)
+
 class AuthenticationFactory(ABC):
     """
     An abstract base class for authentication strategy factories.
+
+    Credentials are cached per (strategy type, user_id) until the earlier of
+    `CREDENTIALS_CACHE_TTL` and the credentials expiration, and `KeyError`/`PermissionError`
+    outcomes for `CREDENTIALS_NEGATIVE_CACHE_TTL` seconds.
+
+    Attributes:
+        credential_cache (TTLCache): Cache of the credentials, any object with the `get(key, default)`
+            and `set(key, value, ttl)` methods of `TTLCache` can be plugged in.
     """
 
+    def __init__(self, credential_cache = None):
+        self.credential_cache = CREDENTIALS_CACHE if credential_cache is None else credential_cache
+        self._auth_strategy = None
+
     @abstractmethod
     def create_auth_strategy(self):
         """
@@ -37,8 +81,75 @@ class AuthenticationFactory(ABC):
             result (dict): User credentials.
         """
         logger.info("****AuthenticationFactory.get_credentials()****")
-        auth_strategy = self.create_auth_strategy()
-        return auth_strategy.get_credentials(user_id)
+        auth_strategy = self.get_auth_strategy()
+        credentials = self.get_cached_credentials(user_id)
+        if credentials is not MISSING:
+            return credentials
+        try:
+            credentials, expires_at = auth_strategy.get_credentials_with_expiration(user_id)
+        except (KeyError, PermissionError) as err:
+            self.cache_error(user_id, err)
+            raise
+        self.cache_credentials(user_id, credentials, expires_at)
+        return credentials
+
+    def get_cached_credentials(self, user_id):
+        """
+        Returns the cached credentials of the user.
+
+        Parameters:
+            user_id (str): The ID of the user.
+
+        Returns:
+            The credentials or `MISSING` when they are not cached.
+
+        Raises:
+            KeyError, PermissionError: When the last lookup of the user failed recently.
+        """
+        cached = self.credential_cache.get(self._cache_key(user_id), MISSING)
+        if cached is not MISSING:
+            logger.debug("Credentials found in cache")
+            if isinstance(cached, (KeyError, PermissionError)):
+                raise type(cached)(*cached.args)
+        return cached
+
+    def cache_credentials(self, user_id, credentials, expires_at = None):
+        """
+        Stores the credentials of the user until the earlier of the cache ttl and `expires_at`.
+
+        Parameters:
+            user_id (str): The ID of the user.
+            credentials: The credentials to store.
+            expires_at (float, optional): Epoch when the credentials expire.
+        """
+        ttl = get_configuration().credentials_cache_ttl
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+        self.credential_cache.set(self._cache_key(user_id), credentials, ttl)
+
+    def cache_error(self, user_id, error):
+        """
+        Remembers for a short time that the credentials of the user could not be resolved.
+
+        Parameters:
+            user_id (str): The ID of the user.
+            error (Exception): The KeyError or PermissionError raised by the strategy.
+        """
+        self.credential_cache.set(self._cache_key(user_id), error, get_configuration().credentials_negative_cache_ttl)
+
+    def _cache_key(self, user_id):
+        return (type(self.get_auth_strategy()).__name__, user_id)
+
+    def get_auth_strategy(self):
+        """
+        Returns the authentication strategy of the factory, created once and reused.
+
+        Returns:
+            AuthenticationStrategy: The strategy.
+        """
+        if self._auth_strategy is None:
+            self._auth_strategy = self.create_auth_strategy()
+        return self._auth_strategy
 
 
 class SOAPAuthenticationFactory(AuthenticationFactory):
@@ -53,7 +164,7 @@ class SOAPAuthenticationFactory(AuthenticationFactory):
             SOAPAuthStrategy: An instance of SOAPAuthStrategy class.
         """
         logger.info("****SOAPAuthenticationFactory.create_auth_strategy()****")
-        return SOAPAuthStrategy()
+        return load_strategy('SOAPAuthStrategy')()
 
 class RESTAuthenticationFactory(AuthenticationFactory):
     """
@@ -68,7 +179,7 @@ class RESTAuthenticationFactory(AuthenticationFactory):
             RESTAuthStrategy: An instance of RESTAuthStrategy class.
         """
         logger.info("****RESTAuthenticationFactory.create_auth_strategy()****")
-        return RESTAuthStrategy()
+        return load_strategy('RESTAuthStrategy')()
 
 class ESAuthenticationFactory(AuthenticationFactory):
     """
@@ -83,7 +194,7 @@ class ESAuthenticationFactory(AuthenticationFactory):
             ESAuthStrategy: An instance of ESAuthStrategy class.
         """
         logger.info("****ESAuthenticationFactory.create_auth_strategy()****")
-        return ESAuthStrategy()
+        return load_strategy('ESAuthStrategy')()
 
 class ReportingAuthenticationFactory(AuthenticationFactory):
     """
@@ -98,7 +209,7 @@ class ReportingAuthenticationFactory(AuthenticationFactory):
             ReportingAuthStrategy: An instance of ReportingAuthStrategy class.
         """
         logger.info("****ReportingAuthenticationFactory.create_auth_strategy()****")
-        return ReportingAuthStrategy()
+        return load_strategy('ReportingAuthStrategy')()
 
 class FileStorageAuthenticationFactory(AuthenticationFactory):
     """
@@ -113,7 +224,7 @@ class FileStorageAuthenticationFactory(AuthenticationFactory):
             FileStorageAtuhStrategy: An instance of FileStorageAtuhStrategy class.
         """
         logger.info("****FileStorageAuthenticationFactory.create_auth_strategy()****")
-        return FileStorageAtuhStrategy()
+        return load_strategy('FileStorageAtuhStrategy')()
 
 class ChecksAuthenticationFactory(AuthenticationFactory):
     """
@@ -128,4 +239,77 @@ class ChecksAuthenticationFactory(AuthenticationFactory):
             ChecksAuthStrategy: An instance of ChecksAuthStrategy class.
         """
         logger.info("****ChecksAuthenticationFactory.create_auth_strategy()****")
-        return ChecksAuthStrategy()
+        return load_strategy('ChecksAuthStrategy')()
+
+
+class CompositeAuthenticationFactory(AuthenticationFactory):
+    """
+    A subclass of AuthenticationFactory that resolves the credentials of several factories at
+    once. The DynamoDB strategies share a single query projected on the union of the attributes
+    each one needs, and the item is handed to every parser.
+
+    Attributes:
+        factories (tuple): The factories whose credentials are resolved, in order.
+    """
+
+    def __init__(self, *factories, credential_cache = None):
+        super().__init__(credential_cache)
+        self.factories = factories
+
+    def create_auth_strategy(self):
+        """
+        This function returns the strategies of the composed factories.
+
+        Returns:
+            list: The AuthenticationStrategy of every factory.
+        """
+        logger.info("****CompositeAuthenticationFactory.create_auth_strategy()****")
+        return [factory.get_auth_strategy() for factory in self.factories]
+
+    def get_credentials(self, user_id = None):
+        """
+        Retrieves the credentials of every composed factory for the given user ID.
+
+        Parameters:
+            user_id (str, optional): The ID of the user for which to retrieve credentials.
+
+        Returns:
+            tuple: The credentials of each factory, in the order the factories were given.
+        """
+        logger.info("****CompositeAuthenticationFactory.get_credentials()****")
+        results = [None] * len(self.factories)
+        pending = []
+        for index, factory in enumerate(self.factories):
+            auth_strategy = factory.get_auth_strategy()
+            credentials = factory.get_cached_credentials(user_id)
+            if credentials is not MISSING:
+                results[index] = credentials
+            elif getattr(auth_strategy, 'REQUIRED_ATTRIBUTES', None):
+                pending.append(index)
+            else:
+                results[index] = factory.get_credentials(user_id)
+        if pending:
+            self._resolve_from_session_item(user_id, pending, results)
+        return tuple(results)
+
+    def _resolve_from_session_item(self, user_id, pending, results):
+        attributes = set()
+        for index in pending:
+            attributes.update(self.factories[index].get_auth_strategy().REQUIRED_ATTRIBUTES)
+        first_strategy = self.factories[pending[0]].get_auth_strategy()
+        try:
+            item = first_strategy.get_session_item(user_id, attributes)
+        except KeyError as err:
+            for index in pending:
+                self.factories[index].cache_error(user_id, err)
+            raise
+        for index in pending:
+            factory = self.factories[index]
+            auth_strategy = factory.get_auth_strategy()
+            try:
+                credentials = auth_strategy.parse_credentials(item)
+            except (KeyError, PermissionError) as err:
+                factory.cache_error(user_id, err)
+                raise
+            factory.cache_credentials(user_id, credentials, auth_strategy.credentials_expiration(item))
+            results[index] = credentials
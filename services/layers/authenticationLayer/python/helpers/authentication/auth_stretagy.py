@@ -23,3 +23,15 @@ class AuthenticationStrategy(ABC):
             NotImplementedError: This method must be overridden.
         """
         raise NotImplementedError("Abstract Method")
+
+    def get_credentials_with_expiration(self, user_id):
+        """
+        Retrieves the user's credentials together with the moment they stop being valid.
+
+        Parameters:
+            user_id (str): The ID of the user for which to retrieve credentials.
+
+        Returns:
+            tuple: The credentials and their expiration epoch, None when it is unknown.
+        """
+        return self.get_credentials(user_id), None
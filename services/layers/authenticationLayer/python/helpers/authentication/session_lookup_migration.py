@@ -0,0 +1,121 @@
+"""
+This module fills the table keyed by keycloakId used by the `get_item` session lookup mode from the
+users-sessions table, keeping the newest record of every keycloakId:
+    - `backfill_session_lookup_table` copies the existing records once.
+    - `sync_session_lookup_records` applies the DynamoDB Streams records of the users-sessions
+      table (NEW_AND_OLD_IMAGES), so sessions created, changed or removed afterwards reach the
+      lookup table. It runs in the `session_lookup_sync` handler.
+
+Usage (from the authentication layer `python` folder):
+    SESSION_LOOKUP_TABLE=<table> python -m helpers.authentication.session_lookup_migration
+"""
+# pylint: disable=line-too-long
+
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+
+from utils.logger_config import setup_logger
+from .auth_dynamo_credentials import get_session_table, get_session_lookup_table, is_newer_session
+
+logger = setup_logger(__name__)
+
+_DESERIALIZER = TypeDeserializer()
+
+
+def backfill_session_lookup_table(source_table = None, lookup_table = None) -> int:
+    """
+    Copies the latest session record of every keycloakId into the lookup table.
+
+    Parameters:
+        source_table (boto3 Table, optional): Table to scan, the users-sessions table by default.
+        lookup_table (boto3 Table, optional): Table keyed by keycloakId, `SESSION_LOOKUP_TABLE` by default.
+
+    Returns:
+        int: Number of records written.
+    """
+    logger.info("****backfill_session_lookup_table()****")
+    source_table = source_table or get_session_table()
+    lookup_table = lookup_table or get_session_lookup_table()
+    latest = {}
+    scan_arguments = {}
+    while True:
+        response = source_table.scan(**scan_arguments)
+        for item in response.get('Items', []):
+            keycloak_id = item.get('keycloakId')
+            if not keycloak_id:
+                continue
+            if is_newer_session(item, latest.get(keycloak_id)):
+                latest[keycloak_id] = item
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_arguments['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    with lookup_table.batch_writer(overwrite_by_pkeys=['keycloakId']) as batch:
+        for item in latest.values():
+            batch.put_item(Item=item)
+    logger.info("%s session records copied to the lookup table", len(latest))
+    return len(latest)
+
+
+def _stream_image(record: dict, image: str):
+    image = record.get('dynamodb', {}).get(image)
+    if not image:
+        return None
+    return {key: _DESERIALIZER.deserialize(value) for key, value in image.items()}
+
+
+def sync_session_lookup_records(records: list, lookup_table = None) -> int:
+    """
+    Applies DynamoDB Streams records of the users-sessions table to the lookup table. A created
+    or changed session replaces the copy of its keycloakId unless the copy is newer, a removed
+    session deletes the copy when it is the same record. Both are conditional writes, so shards
+    and retries applied concurrently never put an older session over a newer one. DateOfCreation
+    is compared as stored, ISO 8601 values in the same offset.
+
+    Parameters:
+        records (list): The `Records` of the stream event.
+        lookup_table (boto3 Table, optional): Table keyed by keycloakId, `SESSION_LOOKUP_TABLE` by default.
+
+    Returns:
+        int: Number of records written or deleted.
+    """
+    logger.info("****sync_session_lookup_records()****")
+    lookup_table = lookup_table or get_session_lookup_table()
+    changes = 0
+    for record in records:
+        if record.get('eventName') == 'REMOVE':
+            item = _stream_image(record, 'OldImage')
+            if not item or not item.get('keycloakId'):
+                continue
+            try:
+                lookup_table.delete_item(
+                    Key={'keycloakId': item['keycloakId']},
+                    ConditionExpression='DateOfCreation = :created',
+                    ExpressionAttributeValues={':created': item.get('DateOfCreation')}
+                )
+                changes += 1
+            except ClientError as error:
+                if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+            continue
+        item = _stream_image(record, 'NewImage')
+        if not item or not item.get('keycloakId'):
+            continue
+        condition = {'ConditionExpression': 'attribute_not_exists(keycloakId)'}
+        if item.get('DateOfCreation') is not None:
+            # Changes of the same session (equal DateOfCreation) are applied too
+            condition = {
+                'ConditionExpression': 'attribute_not_exists(keycloakId) OR DateOfCreation <= :created',
+                'ExpressionAttributeValues': {':created': item['DateOfCreation']},
+            }
+        try:
+            lookup_table.put_item(Item=item, **condition)
+            changes += 1
+        except ClientError as error:
+            if error.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+    logger.info("%s session records synchronized to the lookup table", changes)
+    return changes
+
+
+if __name__ == '__main__':
+    backfill_session_lookup_table()
@@ -0,0 +1,310 @@
+"""
+Helper that exports the circuit breakers of the SOAP backends, one per backend shared by every
+client of the container.
+
+A breaker keeps the outcome and latency of the recent calls:
+    - closed: calls go through with a timeout adapted to the observed p99 latency of their
+      operation, operations have their own latency window since their latencies differ widely.
+    - open: the error rate exceeded the threshold, calls fail fast with CircuitOpenError.
+    - half open: after `open_seconds` a few trial calls go through, closing the circuit on success
+      and opening it again on failure.
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import requests
+from zeep.exceptions import TransportError
+
+from utils.logger_config import setup_logger
+
+from .exceptions import CircuitOpenError
+from .transport import get_backend_key
+
+logger = setup_logger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+__BREAKERS = {}
+__BREAKERS_LOCK = threading.Lock()
+
+
+def is_backend_failure(error: Exception) -> bool:
+    """
+    Returns whether an error means the backend is unhealthy, SOAP faults are answers of a
+    healthy backend and do not count.
+
+    Args:
+        error (Exception): The error raised by the call.
+
+    Returns:
+        bool: True for connection errors, timeouts and HTTP 5xx responses.
+    """
+    if isinstance(error, TransportError):
+        return error.status_code >= 500
+    return isinstance(error, requests.RequestException)
+
+
+class CircuitBreaker:  # pylint: disable=too-many-instance-attributes
+    """
+    Circuit breaker with a rolling error rate and adaptive timeouts.
+
+    Attributes:
+        name (str): The backend protected by the breaker.
+        window_seconds (float): Age of the oldest call considered by the error rate.
+        min_calls (int): Calls in the window needed before the circuit can open.
+        error_threshold (float): Error rate (0-1) that opens the circuit.
+        open_seconds (float): Seconds the circuit stays open before the trial calls.
+        half_open_calls (int): Concurrent trial calls allowed while half open.
+        timeout_multiplier (float): Factor applied to the p99 latency of an operation to get its timeout.
+        min_timeout (float): Lower bound of the adaptive timeout.
+        max_samples (int): Calls kept for the error rate, and successful calls kept per operation.
+    """
+
+    def __init__(self, name: str, window_seconds: float = 60, min_calls: int = 10,  # pylint: disable=too-many-arguments
+                 error_threshold: float = 0.5, open_seconds: float = 30, half_open_calls: int = 1,
+                 timeout_multiplier: float = 1.5, min_timeout: float = 2, max_samples: int = 500):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.max_samples = max_samples
+        self._calls = deque(maxlen=max_samples)
+        self._latencies = {}
+        self._state = CLOSED
+        self._opened_at = 0
+        self._trials = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """Current state, an open circuit becomes half open after `open_seconds`"""
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def _transition(self, state: str):
+        logger.warning("Circuit breaker of %s: %s -> %s", self.name, self._state, state)
+        self._state = state
+        self._trials = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == CLOSED:
+            self._calls.clear()
+            self._latencies.clear()
+
+    def before_call(self) -> bool:
+        """
+        Reserves a call, to be followed by `record_success` or `record_failure`.
+
+        Returns:
+            bool: Whether the call is a half open trial.
+
+        Raises:
+            CircuitOpenError: When the circuit is open or the trial calls are taken.
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return False
+            if state == HALF_OPEN and self._trials < self.half_open_calls:
+                self._trials += 1
+                return True
+            self._rejected += 1
+            retry_after = max(self.open_seconds - (now - self._opened_at), 1)
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self, latency: float, trial: bool = False, operation: str = None):
+        """Records a call that got an answer from the backend, in the latency window of its operation"""
+        with self._lock:
+            now = time.monotonic()
+            self._calls.append((now, True, latency))
+            if operation is not None:
+                if operation not in self._latencies:
+                    self._latencies[operation] = deque(maxlen=self.max_samples)
+                self._latencies[operation].append((now, latency))
+            if trial and self._state == HALF_OPEN:
+                self._transition(CLOSED)
+
+    def record_failure(self, latency: float, trial: bool = False):
+        """Records a call that failed because of the backend"""
+        with self._lock:
+            now = time.monotonic()
+            self._calls.append((now, False, latency))
+            if trial or self._state == HALF_OPEN:
+                self._transition(OPEN)
+            elif self._state == CLOSED:
+                total, errors = self._window_counts(now)
+                if total >= self.min_calls and errors / total >= self.error_threshold:
+                    self._transition(OPEN)
+
+    def release_trial(self):
+        """Frees a trial call that ended without telling anything about the backend"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._trials > 0:
+                self._trials -= 1
+
+    def _window_counts(self, now: float) -> tuple:
+        total = errors = 0
+        for timestamp, success, _ in self._calls:
+            if now - timestamp <= self.window_seconds:
+                total += 1
+                errors += not success
+        return total, errors
+
+    def latency_percentile(self, percentile: float, operation: str = None):
+        """
+        Returns a percentile of the latency of the successful calls in the window.
+
+        Args:
+            percentile (float): The percentile, from 0 to 100.
+            operation (str, optional): The operation, every call of the backend by default.
+
+        Returns:
+            float: The latency in seconds, None without successful calls.
+        """
+        return _percentile(self._window_latencies(operation), percentile)
+
+    def _window_latencies(self, operation: str = None) -> list:
+        with self._lock:
+            now = time.monotonic()
+            if operation is None:
+                samples = ((timestamp, latency) for timestamp, success, latency in self._calls if success)
+            else:
+                samples = iter(self._latencies.get(operation, ()))
+            return sorted(
+                latency for timestamp, latency in samples
+                if now - timestamp <= self.window_seconds
+            )
+
+    def timeout(self, max_timeout: float = None, operation: str = None):
+        """
+        Returns the timeout of the next call of the operation, its p99 latency times
+        `timeout_multiplier` bounded by `min_timeout` and `max_timeout`, or `max_timeout` until
+        `min_calls` calls of the operation succeeded or when no operation is given.
+
+        Args:
+            max_timeout (float, optional): The configured timeout, None waits forever.
+            operation (str, optional): The operation of the call.
+
+        Returns:
+            float: Seconds to wait for the call.
+        """
+        if operation is None:
+            return max_timeout
+        latencies = self._window_latencies(operation)
+        if len(latencies) < self.min_calls:
+            return max_timeout
+        adaptive = max(_percentile(latencies, 99) * self.timeout_multiplier, self.min_timeout)
+        return adaptive if max_timeout is None else min(adaptive, max_timeout)
+
+    @contextmanager
+    def guard(self, operation: str = None):
+        """
+        Wraps a call to the backend: fails fast while the circuit is open and records the outcome.
+
+        Args:
+            operation (str, optional): The operation of the call, whose latency window gets the
+                latency of the call when it succeeds.
+
+        Raises:
+            CircuitOpenError: When the circuit is open.
+        """
+        trial = self.before_call()
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as error:
+            if is_backend_failure(error):
+                self.record_failure(time.monotonic() - start, trial)
+            elif trial:
+                self.release_trial()
+            raise
+        except BaseException:
+            # e.g. GeneratorExit of an abandoned stream
+            if trial:
+                self.release_trial()
+            raise
+        self.record_success(time.monotonic() - start, trial, operation)
+
+    def snapshot(self) -> dict:
+        """
+        Returns the state of the breaker, meant to be published as metrics.
+
+        Returns:
+            dict: name, state, calls and errors in the window, error rate, p50/p99 latency,
+                current adaptive timeout of every operation and calls rejected since the
+                container started.
+        """
+        state = self.state
+        with self._lock:
+            total, errors = self._window_counts(time.monotonic())
+            rejected = self._rejected
+            operations = list(self._latencies)
+        return {
+            'name': self.name,
+            'state': state,
+            'calls': total,
+            'errors': errors,
+            'error_rate': errors / total if total else 0.0,
+            'p50': self.latency_percentile(50),
+            'p99': self.latency_percentile(99),
+            'timeouts': {operation: self.timeout(operation=operation) for operation in operations},
+            'rejected': rejected,
+        }
+
+
+def _percentile(sorted_values: list, percentile: float):
+    if not sorted_values:
+        return None
+    index = math.ceil(percentile / 100 * len(sorted_values)) - 1
+    return sorted_values[min(max(index, 0), len(sorted_values) - 1)]
+
+
+def get_circuit_breaker(url: str) -> CircuitBreaker:
+    """
+    Returns the breaker shared by the clients of the backend of the url, configured with
+    `SOAP_BREAKER_WINDOW`, `SOAP_BREAKER_MIN_CALLS`, `SOAP_BREAKER_ERROR_THRESHOLD`,
+    `SOAP_BREAKER_OPEN_SECONDS`, `SOAP_ADAPTIVE_TIMEOUT_MULTIPLIER` and `SOAP_ADAPTIVE_TIMEOUT_MIN`.
+
+    Args:
+        url (str): Any url of the backend, usually the WSDL.
+
+    Returns:
+        CircuitBreaker: The breaker of the backend.
+    """
+    backend = get_backend_key(url)
+    with __BREAKERS_LOCK:
+        if backend not in __BREAKERS:
+            __BREAKERS[backend] = CircuitBreaker(
+                backend,
+                window_seconds=float(os.environ.get('SOAP_BREAKER_WINDOW', '60')),
+                min_calls=int(os.environ.get('SOAP_BREAKER_MIN_CALLS', '10')),
+                error_threshold=float(os.environ.get('SOAP_BREAKER_ERROR_THRESHOLD', '0.5')),
+                open_seconds=float(os.environ.get('SOAP_BREAKER_OPEN_SECONDS', '30')),
+                timeout_multiplier=float(os.environ.get('SOAP_ADAPTIVE_TIMEOUT_MULTIPLIER', '1.5')),
+                min_timeout=float(os.environ.get('SOAP_ADAPTIVE_TIMEOUT_MIN', '2'))
+            )
+        return __BREAKERS[backend]
+
+
+def get_circuit_breaker_states() -> list:
+    """Returns the snapshot of the breaker of every backend used by the container"""
+    with __BREAKERS_LOCK:
+        breakers = list(__BREAKERS.values())
+    return [breaker.snapshot() for breaker in breakers]
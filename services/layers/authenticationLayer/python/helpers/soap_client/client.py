@@ -2,26 +2,25 @@
 Helper that exports the soap client that manages the translation between SOAP and REST operations
 """
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from utils.logger_config import setup_logger
 
 from zeep import Client
 
+from .transport import get_transport
+
 logger = setup_logger(__name__)
 
 __CLIENTS = {}
+__CLIENTS_BY_URL = {}
+__URL_LOCKS = {}
+__REGISTRY_LOCK = threading.Lock()
 
-def get_client(version: str = "1", transport = None):
-    """Initializes singleton SOAP instance
-
-    Params:
-        version (str, default=1): The version of the api soap
 
-    Returns:
-        suds.Client: the suds initialized client with the soap configuration
-    """
-    logger.info("****get_client() AUthLayer****")
-        
-    endpoints_url = {
+def get_endpoints_url() -> dict:
+    """Returns the url of the soap api of every version"""
+    return {
         "1": os.environ.get('LEGACY_FRONT_OFFICE1', ''),
         "2": os.environ.get('LEGACY_FRONT_OFFICE2', ''),
         "ReportExecution2005": os.environ.get('REPORTING_SERVICES_WSDL', ''),
@@ -31,20 +30,121 @@ def get_client(version: str = "1", transport = None):
         "collection_payments": os.environ.get("COLLECTION_PAYMENTS_WSDL", '')
     }
 
-    if version in __CLIENTS:
-        return __CLIENTS[version]
 
-    soap_url = endpoints_url.get(version, None)
+def get_wsdl_url(version: str = "1") -> str:
+    """Returns the WSDL url of the version
+
+    Params:
+        version (str, default=1): The version of the api soap
+
+    Raises:
+        ValueError: When the version has no url configured
+    """
+    soap_url = get_endpoints_url().get(version, None)
     logger.info(f"Layer Using the version {version} of the api hermes: {soap_url}")
 
     if not soap_url:
         logger.error("Api url hermes 1 version not found")
         raise ValueError("Api url hermes 1 version not found")
+    return f'{soap_url}?WSDL'
+
 
-    if transport:
-        __CLIENTS[version] = Client(f'{soap_url}?wsdl', transport=transport)
+def get_client(version: str = "1", transport = None):
+    """Initializes singleton SOAP instance
+
+    The WSDL and XSD documents are read from the WSDL cache when it is fresh, so building
+    the client does not touch the network. Versions that resolve to the same url share the
+    client, and concurrent callers of the same url wait for a single construction. Unless a
+    transport is given, the pooled transport of the backend is used. A given transport is used
+    as is, it only reads the WSDL cache when the caller configured it.
+
+    Params:
+        version (str, default=1): The version of the api soap
+
+    Returns:
+        suds.Client: the suds initialized client with the soap configuration
+    """
+    logger.info("****get_client() AUthLayer****")
+
+    if version in __CLIENTS:
         return __CLIENTS[version]
 
-    __CLIENTS[version] = Client(f'{soap_url}?WSDL')
+    wsdl_url = get_wsdl_url(version)
+
+    with _get_url_lock(wsdl_url):
+        client = __CLIENTS_BY_URL.get(wsdl_url)
+        if client is None:
+            if not transport:
+                transport = get_transport(wsdl_url)
+            client = Client(wsdl_url, transport=transport)
+            __CLIENTS_BY_URL[wsdl_url] = client
+        __CLIENTS[version] = client
     logger.info(f"_CLIENTS=>{__CLIENTS}")
-    return __CLIENTS[version]
+    return client
+
+
+def _get_url_lock(wsdl_url: str) -> threading.Lock:
+    with __REGISTRY_LOCK:
+        if wsdl_url not in __URL_LOCKS:
+            __URL_LOCKS[wsdl_url] = threading.Lock()
+        return __URL_LOCKS[wsdl_url]
+
+
+def prewarm_clients(versions: list, timeout: float = None) -> dict:
+    """Builds the clients of the versions concurrently, meant to run during the lambda init
+
+    Versions resolving to the same url are built once. Errors are logged and do not stop the
+    other versions.
+
+    Params:
+        versions (list): The versions of the api soap
+        timeout (float, optional): Seconds to wait for the clients, the pending ones keep
+            being built in background
+
+    Returns:
+        dict: The client or the exception of every version built in time
+    """
+    logger.info("****prewarm_clients()****")
+    versions_by_url = {}
+    for version in versions:
+        try:
+            versions_by_url.setdefault(get_wsdl_url(version), []).append(version)
+        except ValueError as err:
+            logger.error("Unable to prewarm version %s: %s", version, err)
+    if not versions_by_url:
+        return {}
+    executor = ThreadPoolExecutor(max_workers=len(versions_by_url), thread_name_prefix='soap-prewarm')
+    futures = {
+        executor.submit(_prewarm_versions, url_versions): url_versions
+        for url_versions in versions_by_url.values()
+    }
+    wait(futures, timeout=timeout)
+    executor.shutdown(wait=False)
+    result = {}
+    for future, url_versions in futures.items():
+        if not future.done():
+            logger.warning("Client of versions %s still loading after prewarm timeout", url_versions)
+            continue
+        error = future.exception()
+        if error:
+            logger.error("Error prewarming versions %s: %s", url_versions, error)
+        for version in url_versions:
+            result[version] = error or future.result()
+    return result
+
+
+def _prewarm_versions(versions: list):
+    """Builds the client shared by versions that resolve to the same url"""
+    client = None
+    for version in versions:
+        client = get_client(version)
+    return client
+
+
+def prewarm_from_environment() -> dict:
+    """Prewarms the versions listed in SOAP_PREWARM_VERSIONS (comma separated), waiting at most
+    SOAP_PREWARM_TIMEOUT seconds"""
+    versions = [version.strip() for version in os.environ.get('SOAP_PREWARM_VERSIONS', '').split(',') if version.strip()]
+    if not versions:
+        return {}
+    return prewarm_clients(versions, timeout=float(os.environ.get('SOAP_PREWARM_TIMEOUT', '8')))
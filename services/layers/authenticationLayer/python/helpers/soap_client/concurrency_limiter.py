@@ -0,0 +1,205 @@
+"""
+Helper that exports the concurrency limiters of the SOAP backends, one per backend shared by every
+client of the container.
+
+The limit follows an AIMD rule on the latency of the successful calls, compared with the no load
+latency of their own operation:
+    - additive increase: a call answered close to the no load latency raises the limit by 1/limit,
+      about one more call per round of calls, while the limit is in use or calls wait for a slot.
+    - multiplicative decrease: a call slower than `latency_tolerance` times the no load latency, or
+      failing because of the backend, multiplies the limit by `backoff_ratio`.
+SOAP faults and calls without an operation (streams) hold a slot but do not adapt the limit.
+
+Calls over the limit wait up to `queue_timeout` seconds for a slot and then fail with
+ConcurrencyLimitExceeded, answered with 429 by the handlers.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.logger_config import setup_logger
+
+from .circuit_breaker import is_backend_failure
+from .exceptions import ConcurrencyLimitExceeded
+from .transport import get_backend_key
+
+logger = setup_logger(__name__)
+
+__LIMITERS = {}
+__LIMITERS_LOCK = threading.Lock()
+
+
+class AdaptiveConcurrencyLimiter:  # pylint: disable=too-many-instance-attributes
+    """
+    Limits the calls in flight to a backend with a limit adapted to its latency.
+
+    Attributes:
+        name (str): The backend protected by the limiter.
+        limit (float): Current number of calls allowed in flight.
+        min_limit (int): Lower bound of the limit.
+        max_limit (int): Upper bound of the limit.
+        latency_tolerance (float): Latency, relative to the no load latency, that lowers the limit.
+        backoff_ratio (float): Factor applied to the limit when it is lowered.
+        queue_timeout (float): Seconds a call waits for a slot before it is rejected.
+    """
+
+    def __init__(self, name: str, initial_limit: int = 10, min_limit: int = 1,  # pylint: disable=too-many-arguments
+                 max_limit: int = 10, latency_tolerance: float = 2.0, backoff_ratio: float = 0.9,
+                 queue_timeout: float = 1.0):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial_limit, min_limit), self.max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+        self.queue_timeout = queue_timeout
+        self._in_flight = 0
+        self._waiting = 0
+        self._no_load_latency = {}
+        self._rejected = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: float = None):
+        """
+        Takes a slot, waiting while the calls in flight are at the limit.
+
+        Args:
+            timeout (float, optional): Seconds to wait for a slot, `queue_timeout` by default.
+
+        Raises:
+            ConcurrencyLimitExceeded: When no slot was freed in time.
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._rejected += 1
+                    raise ConcurrencyLimitExceeded(
+                        self.name, retry_after=1,
+                        message=f'Backend {self.name} has {self._in_flight} calls in flight, limit {int(self.limit)}'
+                    )
+                self._waiting += 1
+                try:
+                    self._condition.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_flight += 1
+
+    def release(self, latency: float = None, overloaded: bool = False, operation: str = None):
+        """
+        Frees a slot and adapts the limit to the outcome of the call.
+
+        Args:
+            latency (float, optional): Seconds the call took to succeed, None when it tells nothing
+                about the backend.
+            overloaded (bool, optional): Whether the call failed because of the backend.
+            operation (str, optional): The operation of the call, the latency is ignored without it.
+        """
+        with self._condition:
+            in_flight = self._in_flight
+            self._in_flight -= 1
+            if overloaded:
+                self._decrease()
+            elif latency is not None and operation is not None:
+                self._update(latency, in_flight, operation)
+            self._condition.notify()
+
+    def _update(self, latency: float, in_flight: int, operation: str):
+        no_load_latency = self._no_load_latency.get(operation)
+        if no_load_latency is None or latency < no_load_latency:
+            no_load_latency = latency
+        else:
+            # Drifts up slowly so a permanent change of the backend latency is learned
+            no_load_latency += (latency - no_load_latency) * 0.01
+        self._no_load_latency[operation] = no_load_latency
+        if latency > no_load_latency * self.latency_tolerance:
+            self._decrease()
+        elif in_flight * 2 >= self.limit or self._waiting:
+            self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+
+    def _decrease(self):
+        limit = max(self.limit * self.backoff_ratio, self.min_limit)
+        if int(limit) < int(self.limit):
+            logger.warning("Concurrency limit of %s lowered to %s", self.name, int(limit))
+        self.limit = limit
+
+    @contextmanager
+    def slot(self, operation: str = None):
+        """
+        Wraps a call to the backend holding a slot for its duration.
+
+        Args:
+            operation (str, optional): The operation of the call, whose latency adapts the limit
+                when it succeeds.
+
+        Raises:
+            ConcurrencyLimitExceeded: When no slot was freed in time.
+        """
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as error:
+            # SOAP faults are answered fast and would drag the no load latency down
+            self.release(overloaded=is_backend_failure(error))
+            raise
+        except BaseException:
+            # e.g. GeneratorExit of an abandoned stream
+            self.release()
+            raise
+        self.release(time.monotonic() - start, operation=operation)
+
+    def snapshot(self) -> dict:
+        """
+        Returns the state of the limiter, meant to be published as metrics.
+
+        Returns:
+            dict: name, current limit, calls in flight and waiting, no load latency of every
+                operation and calls rejected since the container started.
+        """
+        with self._condition:
+            return {
+                'name': self.name,
+                'limit': int(self.limit),
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'no_load_latency': dict(self._no_load_latency),
+                'rejected': self._rejected,
+            }
+
+
+def get_concurrency_limiter(url: str) -> AdaptiveConcurrencyLimiter:
+    """
+    Returns the limiter shared by the clients of the backend of the url, configured with
+    `SOAP_CONCURRENCY_INITIAL`, `SOAP_CONCURRENCY_MIN`, `SOAP_CONCURRENCY_MAX` (`SOAP_POOL_MAXSIZE`
+    by default), `SOAP_CONCURRENCY_LATENCY_TOLERANCE` and `SOAP_CONCURRENCY_QUEUE_TIMEOUT`.
+
+    Args:
+        url (str): Any url of the backend, usually the WSDL.
+
+    Returns:
+        AdaptiveConcurrencyLimiter: The limiter of the backend.
+    """
+    backend = get_backend_key(url)
+    with __LIMITERS_LOCK:
+        if backend not in __LIMITERS:
+            max_limit = os.environ.get('SOAP_CONCURRENCY_MAX', os.environ.get('SOAP_POOL_MAXSIZE', '10'))
+            __LIMITERS[backend] = AdaptiveConcurrencyLimiter(
+                backend,
+                initial_limit=int(os.environ.get('SOAP_CONCURRENCY_INITIAL', max_limit)),
+                min_limit=int(os.environ.get('SOAP_CONCURRENCY_MIN', '1')),
+                max_limit=int(max_limit),
+                latency_tolerance=float(os.environ.get('SOAP_CONCURRENCY_LATENCY_TOLERANCE', '2')),
+                queue_timeout=float(os.environ.get('SOAP_CONCURRENCY_QUEUE_TIMEOUT', '1'))
+            )
+        return __LIMITERS[backend]
+
+
+def get_concurrency_limiter_states() -> list:
+    """Returns the snapshot of the limiter of every backend used by the container"""
+    with __LIMITERS_LOCK:
+        limiters = list(__LIMITERS.values())
+    return [limiter.snapshot() for limiter in limiters]
@@ -0,0 +1,30 @@
+"""
+Exceptions raised when a SOAP backend is not able to take more calls, handlers answer them with a
+retriable status instead of a generic error.
+"""
+
+
+class BackendUnavailableError(Exception):
+    """
+    The SOAP backend is failing or overloaded and the call was not attempted.
+
+    Attributes:
+        backend (str): The backend that rejected the call.
+        retry_after (float): Seconds after which the call may be retried.
+        status_code (int): HTTP status the handlers answer with.
+    """
+    status_code = 503
+
+    def __init__(self, backend: str, retry_after: float = 1, message: str = None):
+        super().__init__(message or f'Backend {backend} unavailable, retry after {retry_after:.0f} seconds')
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(BackendUnavailableError):
+    """The circuit breaker of the backend is open"""
+
+
+class ConcurrencyLimitExceeded(BackendUnavailableError):
+    """The calls in flight to the backend reached its concurrency limit for longer than the queue timeout"""
+    status_code = 429
@@ -0,0 +1,128 @@
+"""
+Helper that calls list shaped SOAP operations in streaming mode: the response is parsed while it is
+downloaded and every repeated record is yielded and released before the next one is read, so the
+memory used does not grow with the size of the response.
+
+Example:
+    for record in stream_records(get_client("1"), "GetGlobalAttribute", "Attribute", session):
+        ...
+"""
+from typing import Iterator, Union
+
+from lxml import etree
+from zeep.wsdl.utils import etree_to_string
+
+from utils.logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# Bounds the search of the record element inside the output type of the operation
+MAX_RECORD_DEPTH = 4
+
+
+def stream_records(client, operation: str, record_tag: str, *args, **kwargs) -> Iterator:
+    """
+    Calls a SOAP operation and yields its repeated `record_tag` elements one at a time.
+
+    Records are parsed with their XSD type when the element is found in the output of the
+    operation, returning the same values as the regular call, otherwise they are returned as dicts
+    with the text of their children.
+
+    Args:
+        client (zeep.Client): The client of the service, its transport must support `post_stream`.
+        operation (str): Name of the SOAP operation.
+        record_tag (str): Local name of the repeated element, e.g. `Attribute`.
+        *args: Arguments of the operation.
+        **kwargs: Keyword arguments of the operation.
+
+    Yields:
+        CompoundValue or dict: Every record of the response.
+
+    Raises:
+        zeep.exceptions.Fault: When the service returns a SOAP fault.
+        zeep.exceptions.TransportError: When the service returns an HTTP error.
+    """
+    logger.info("****stream_records()****")
+    service = client.service
+    binding = service._binding  # pylint: disable=protected-access
+    options = service._binding_options  # pylint: disable=protected-access
+    # pylint: disable-next=protected-access
+    envelope, http_headers = binding._create(operation, args, kwargs, client=client, options=options)
+    operation_obj = binding.get(operation)
+    record_element = find_record_element(operation_obj, record_tag)
+    schema = client.wsdl.types
+
+    response = client.transport.post_stream(options['address'], etree_to_string(envelope), http_headers)
+    try:
+        if response.status_code != 200:
+            # Faults are small, zeep reads them to raise the usual exceptions
+            binding.process_reply(client, operation_obj, response)
+            return
+        for _, element in etree.iterparse(response.raw, events=('end',), tag=f'{{*}}{record_tag}',
+                                          huge_tree=True):
+            if record_element is not None:
+                yield record_element.parse(element, schema)
+            else:
+                yield element_to_dict(element)
+            element.clear()
+            # Drops the records already yielded, iterparse keeps them attached to the root
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    finally:
+        response.close()
+
+
+def find_record_element(operation_obj, record_tag: str):
+    """
+    Finds the XSD element of the repeated records in the output of the operation.
+
+    Args:
+        operation_obj (zeep.wsdl.definitions.Operation): The operation of the binding.
+        record_tag (str): Local name of the repeated element.
+
+    Returns:
+        zeep.xsd.Element: The element or None when it is not found.
+    """
+    body = getattr(operation_obj.output, 'body', None)
+    return _find_element(getattr(body, 'type', None), record_tag, MAX_RECORD_DEPTH) if body is not None else None
+
+
+def _find_element(xsd_type, record_tag: str, depth: int):
+    if xsd_type is None or depth == 0:
+        return None
+    for name, element in getattr(xsd_type, 'elements', []):
+        if name == record_tag:
+            return element
+        found = _find_element(getattr(element, 'type', None), record_tag, depth - 1)
+        if found is not None:
+            return found
+    return None
+
+
+def element_to_dict(element) -> Union[dict, str, None]:
+    """
+    Converts an untyped XML element to a dict keyed by the local name of its children, or to its
+    text when it is a leaf.
+
+    Args:
+        element (lxml.etree._Element): The element.
+
+    Returns:
+        dict, str or None: The children of the element, or its text (None when empty) when it
+            has no children.
+    """
+    if len(element) == 0:
+        return element.text
+    result = {}
+    for child in element:
+        if not isinstance(child.tag, str):
+            continue
+        key = etree.QName(child).localname
+        value = element_to_dict(child)
+        if key in result:
+            if not isinstance(result[key], list):
+                result[key] = [result[key]]
+            result[key].append(value)
+        else:
+            result[key] = value
+    return result
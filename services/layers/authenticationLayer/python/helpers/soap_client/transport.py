@@ -0,0 +1,160 @@
+"""
+Helper that exports the zeep transports used to call the SOAP backends, one per backend shared by
+every client of the container so the connections stay open across warm invocations.
+"""
+import gzip
+import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from zeep import Transport
+
+from utils.logger_config import setup_logger
+
+from .wsdl_cache import get_wsdl_cache
+
+logger = setup_logger(__name__)
+
+__TRANSPORTS = {}
+__TRANSPORTS_LOCK = threading.Lock()
+_UNSET = object()
+
+
+class PooledTransport(Transport):
+    """
+    zeep transport over a pooled keep-alive session, with separate timeouts to load the WSDL and
+    to call the operations and optional gzip encoding of the requests.
+
+    The operation timeout can be overridden per thread with `settings`, so concurrent calls
+    sharing the transport do not change each other's timeout.
+
+    Attributes:
+        compress_requests (bool): Whether the request bodies are sent gzip encoded.
+        compress_min_bytes (int): Bodies smaller than this are sent as they are.
+    """
+
+    def __init__(self, cache=None, timeout=300, operation_timeout=None, session=None,
+                 compress_requests=False, compress_min_bytes=1024):  # pylint: disable=too-many-arguments
+        self._local = threading.local()
+        super().__init__(cache=cache, timeout=timeout, operation_timeout=operation_timeout, session=session)
+        self.compress_requests = compress_requests
+        self.compress_min_bytes = compress_min_bytes
+
+    @property
+    def operation_timeout(self):
+        """Timeout of the operations called by the current thread"""
+        return getattr(self._local, 'operation_timeout', self._operation_timeout)
+
+    @operation_timeout.setter
+    def operation_timeout(self, value):
+        self._operation_timeout = value
+
+    @contextmanager
+    def settings(self, timeout=None):
+        """
+        Overrides the operation timeout of the calling thread only.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the operations, None waits forever.
+        """
+        previous = getattr(self._local, 'operation_timeout', _UNSET)
+        self._local.operation_timeout = timeout
+        try:
+            yield
+        finally:
+            if previous is _UNSET:
+                del self._local.operation_timeout
+            else:
+                self._local.operation_timeout = previous
+
+    def post(self, address, message, headers):
+        """Sends the message gzip encoded when request compression is enabled"""
+        message, headers = self._encode(message, headers)
+        return super().post(address, message, headers)
+
+    def post_stream(self, address, message, headers):
+        """
+        Sends the message like `post` but without reading the response body, which is consumed
+        from `response.raw` already decompressed.
+
+        Args:
+            address (str): The url of the service.
+            message (bytes): The SOAP envelope.
+            headers (dict): The HTTP headers.
+
+        Returns:
+            requests.Response: The streamed response, it must be closed by the caller.
+        """
+        message, headers = self._encode(message, headers)
+        response = self.session.post(
+            address, data=message, headers=headers, timeout=self.operation_timeout, stream=True
+        )
+        response.raw.decode_content = True
+        return response
+
+    def _encode(self, message, headers):
+        if self.compress_requests and len(message) >= self.compress_min_bytes:
+            if isinstance(message, str):
+                message = message.encode('utf-8')
+            message = gzip.compress(message)
+            headers = {**headers, 'Content-Encoding': 'gzip'}
+        return message, headers
+
+
+def create_session(pool_maxsize: int, accept_gzip: bool = True) -> requests.Session:
+    """
+    Creates a keep-alive session with a connection pool of `pool_maxsize` connections.
+
+    Args:
+        pool_maxsize (int): Maximum connections kept open per host.
+        accept_gzip (bool, optional): Whether gzip encoded responses are requested. Defaults to True.
+
+    Returns:
+        requests.Session: The session.
+    """
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, pool_block=False)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+    session.headers['Accept-Encoding'] = 'gzip, deflate' if accept_gzip else 'identity'
+    return session
+
+
+def get_backend_key(url: str) -> str:
+    """Returns the backend of an url, its scheme and host"""
+    parsed_url = urlparse(url)
+    return f'{parsed_url.scheme}://{parsed_url.netloc}'
+
+
+def get_transport(url: str) -> PooledTransport:
+    """
+    Returns the transport shared by the clients of the backend of the url, configured with
+    `SOAP_POOL_MAXSIZE`, `SOAP_LOAD_TIMEOUT`, `SOAP_OPERATION_TIMEOUT`, `SOAP_GZIP_REQUESTS` and
+    `SOAP_ACCEPT_GZIP`.
+
+    Args:
+        url (str): Any url of the backend, usually the WSDL.
+
+    Returns:
+        PooledTransport: The transport of the backend.
+    """
+    backend = get_backend_key(url)
+    with __TRANSPORTS_LOCK:
+        if backend not in __TRANSPORTS:
+            logger.info("Creating transport for %s", backend)
+            operation_timeout = float(os.environ.get('SOAP_OPERATION_TIMEOUT', '30')) or None
+            __TRANSPORTS[backend] = PooledTransport(
+                cache=get_wsdl_cache(),
+                timeout=float(os.environ.get('SOAP_LOAD_TIMEOUT', '30')),
+                operation_timeout=operation_timeout,
+                session=create_session(
+                    int(os.environ.get('SOAP_POOL_MAXSIZE', '10')),
+                    accept_gzip=os.environ.get('SOAP_ACCEPT_GZIP', 'true').lower() == 'true'
+                ),
+                compress_requests=os.environ.get('SOAP_GZIP_REQUESTS', 'false').lower() == 'true'
+            )
+        return __TRANSPORTS[backend]
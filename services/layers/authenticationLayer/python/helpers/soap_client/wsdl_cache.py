@@ -0,0 +1,178 @@
+"""
+Helper that keeps the WSDL and XSD documents loaded by zeep on disk, so the SOAP clients can be
+built without downloading them again on every cold start.
+
+Documents are stored by content hash and indexed by url in two tiers:
+    - seed: read only copy built with the layer (`WSDL_CACHE_SEED_DIR`). It is never revalidated,
+      so a changed WSDL is not seen until the next layer build unless `WSDL_CACHE_SEED_TTL` is set.
+    - local: `/tmp` copy written by the container (`WSDL_CACHE_DIR`), fresh for `WSDL_CACHE_TTL` seconds.
+
+The seed is generated at layer build time (from the authentication layer `python` folder, with the
+LEGACY_FRONT_OFFICE* variables set):
+    python -m helpers.soap_client.wsdl_cache wsdl_cache 1 2
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+from zeep.cache import Base
+
+from utils.logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+INDEX_FILE = 'index.json'
+
+__WSDL_CACHE = None
+__WSDL_CACHE_LOCK = threading.Lock()
+
+
+class WsdlDocumentCache(Base):
+    """
+    zeep cache backend that persists the documents in a directory.
+
+    Attributes:
+        cache_dir (str): Writable directory of the local tier.
+        seed_dir (str): Read only directory generated at build time, may not exist.
+        timeout (int): Seconds a document of the local tier is considered fresh.
+        seed_timeout (int): Seconds since the layer build a document of the seed is considered
+            fresh, None keeps it until the next build.
+    """
+
+    def __init__(self, cache_dir: str, seed_dir: str = None, timeout: int = 86400, seed_timeout: int = None):
+        self.cache_dir = cache_dir
+        self.seed_dir = seed_dir
+        self.timeout = timeout
+        self.seed_timeout = seed_timeout
+        self._lock = threading.Lock()
+        self._index = _read_index(cache_dir)
+        self._seed_index = _read_index(seed_dir) if seed_dir else {}
+
+    def get(self, url):
+        """
+        Returns the cached document of the url if it is fresh and its content hash matches.
+
+        Args:
+            url (str): The url of the document.
+
+        Returns:
+            bytes: The document or None on a miss.
+        """
+        entry = self._index.get(url)
+        if entry and time.time() - entry['stored_at'] < self.timeout:
+            content = _read_document(self.cache_dir, entry['hash'])
+            if content is not None:
+                logger.debug("WSDL cache HIT for %s", url)
+                return content
+        entry = self._seed_index.get(url)
+        if entry and (self.seed_timeout is None or time.time() - entry['stored_at'] < self.seed_timeout):
+            content = _read_document(self.seed_dir, entry['hash'])
+            if content is not None:
+                logger.debug("WSDL seed cache HIT for %s", url)
+                return content
+        logger.debug("WSDL cache MISS for %s", url)
+        return None
+
+    def add(self, url, content):
+        """
+        Stores the document in the local tier.
+
+        Args:
+            url (str): The url of the document.
+            content (bytes): The document.
+        """
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        content_hash = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                _atomic_write(os.path.join(self.cache_dir, f'{content_hash}.xml'), content)
+                self._index[url] = {'hash': content_hash, 'stored_at': time.time()}
+                _atomic_write(
+                    os.path.join(self.cache_dir, INDEX_FILE),
+                    json.dumps(self._index).encode('utf-8')
+                )
+            except OSError as err:
+                logger.warning("Unable to persist the WSDL document of %s: %s", url, err)
+
+
+def _read_index(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, INDEX_FILE), 'rb') as index_file:
+            return json.loads(index_file.read())
+    except (OSError, ValueError):
+        return {}
+
+
+def _read_document(directory: str, content_hash: str):
+    try:
+        with open(os.path.join(directory, f'{content_hash}.xml'), 'rb') as document:
+            content = document.read()
+    except OSError:
+        return None
+    if hashlib.sha256(content).hexdigest() != content_hash:
+        logger.warning("Corrupted WSDL document %s in %s", content_hash, directory)
+        return None
+    return content
+
+
+def _atomic_write(path: str, content: bytes):
+    temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporary_path, 'wb') as output:
+        output.write(content)
+    os.replace(temporary_path, path)
+
+
+def get_wsdl_cache():
+    """
+    Returns the container WSDL cache configured with `WSDL_CACHE_DIR`, `WSDL_CACHE_SEED_DIR`,
+    `WSDL_CACHE_TTL` and `WSDL_CACHE_SEED_TTL`, or None when `WSDL_CACHE_ENABLED` is false.
+
+    Returns:
+        WsdlDocumentCache: The shared cache.
+    """
+    global __WSDL_CACHE  # pylint: disable=global-statement
+    if os.environ.get('WSDL_CACHE_ENABLED', 'true').lower() != 'true':
+        return None
+    with __WSDL_CACHE_LOCK:
+        if __WSDL_CACHE is None:
+            seed_timeout = os.environ.get('WSDL_CACHE_SEED_TTL')
+            __WSDL_CACHE = WsdlDocumentCache(
+                cache_dir=os.environ.get('WSDL_CACHE_DIR', '/tmp/wsdl_cache'),
+                seed_dir=os.environ.get('WSDL_CACHE_SEED_DIR', '/opt/python/wsdl_cache'),
+                timeout=int(os.environ.get('WSDL_CACHE_TTL', '86400')),
+                seed_timeout=int(seed_timeout) if seed_timeout else None
+            )
+        return __WSDL_CACHE
+
+
+def prepopulate_wsdl_cache(output_dir: str, versions: list) -> list:
+    """
+    Loads the WSDL of the given versions and every document it imports into `output_dir`, used at
+    layer build time to generate the seed of the cache.
+
+    Args:
+        output_dir (str): Directory where the documents are written.
+        versions (list): Versions accepted by `get_client`.
+
+    Returns:
+        list: The urls stored in the cache.
+    """
+    # pylint: disable=import-outside-toplevel
+    from zeep import Client, Transport
+    from .client import get_wsdl_url
+
+    cache = WsdlDocumentCache(cache_dir=output_dir, timeout=sys.maxsize)
+    for version in versions:
+        url = get_wsdl_url(version)
+        logger.info("Caching the WSDL of version %s: %s", version, url)
+        Client(url, transport=Transport(cache=cache))
+    return list(cache._index)  # pylint: disable=protected-access
+
+
+if __name__ == '__main__':
+    prepopulate_wsdl_cache(sys.argv[1], sys.argv[2:] or ['1', '2'])
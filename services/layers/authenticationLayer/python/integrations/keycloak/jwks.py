@@ -0,0 +1,147 @@
+"""
+    File to declare the classes used to validate Keycloak access tokens locally,
+    using the signing keys published by the realm (JWKS)
+"""
+#pylint: disable=line-too-long
+import threading
+import time
+
+import jwt
+
+from utils.logger_config import setup_logger
+from . import keycloak_http
+
+logger = setup_logger(__name__)
+
+ALLOWED_ALGORITHMS = ['RS256', 'RS384', 'RS512', 'PS256', 'PS384', 'PS512', 'ES256', 'ES384', 'ES512']
+
+__JWKS_CACHES = {}
+__JWKS_CACHES_LOCK = threading.Lock()
+
+
+class UnknownSigningKeyError(Exception):
+    """
+    Raised when the token was signed with a key that is not published in the realm JWKS,
+    even after refreshing it.
+    """
+
+
+class JWKSCache:
+    """
+    Container-lifetime cache of the signing keys published by a Keycloak realm.
+
+    Attributes:
+        jwks_url (str): URL of the realm certs endpoint.
+        ttl (int): Seconds the fetched key set is considered fresh.
+        min_refresh_interval (int): Minimum seconds between two forced refreshes caused by
+            an unknown `kid`, so random tokens cannot make us hammer Keycloak.
+    """
+
+    def __init__(self, jwks_url: str, ttl: int = 3600, min_refresh_interval: int = 30):
+        self.jwks_url = jwks_url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.keys = {}
+        self.fetched_at = 0.0
+        self.lock = threading.Lock()
+
+    def get_signing_key(self, kid: str) -> jwt.PyJWK:
+        """
+        Returns the key identified by `kid`, fetching the key set when it is expired and
+        refreshing it once when the `kid` is unknown (key rotation).
+
+        Args:
+            kid (str): Key id taken from the token header.
+
+        Returns:
+            jwt.PyJWK: The signing key.
+
+        Raises:
+            UnknownSigningKeyError: When the key is not published by the realm.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if not self.keys or now - self.fetched_at > self.ttl:
+                self._refresh(now)
+            elif kid not in self.keys and now - self.fetched_at > self.min_refresh_interval:
+                logger.info("Unknown kid %s, refreshing JWKS", kid)
+                self._refresh(now)
+            if kid not in self.keys:
+                raise UnknownSigningKeyError(f"Signing key {kid} not found in {self.jwks_url}")
+            return self.keys[kid]
+
+    def _refresh(self, now: float):
+        """
+        Downloads the key set and keeps only the keys usable to verify signatures.
+        """
+        logger.info("****JWKSCache._refresh()****")
+        response = keycloak_http.request('GET', self.jwks_url, idempotent=True)
+        response.raise_for_status()
+        keys = {}
+        for key_data in response.json().get('keys', []):
+            if key_data.get('use', 'sig') != 'sig' or 'kid' not in key_data:
+                continue
+            try:
+                keys[key_data['kid']] = jwt.PyJWK(key_data)
+            except jwt.PyJWKError as err:
+                logger.debug("Skipping key %s: %s", key_data.get('kid'), err)
+        self.keys = keys
+        self.fetched_at = now
+        logger.debug("JWKS loaded with %s signing keys", len(keys))
+
+
+def get_jwks_cache(jwks_url: str, ttl: int = 3600) -> JWKSCache:
+    """Returns the singleton JWKS cache for the given url"""
+    with __JWKS_CACHES_LOCK:
+        if jwks_url not in __JWKS_CACHES:
+            __JWKS_CACHES[jwks_url] = JWKSCache(jwks_url, ttl=ttl)
+        return __JWKS_CACHES[jwks_url]
+
+
+class LocalTokenValidator:
+    """
+    Validates Keycloak access tokens without calling Keycloak: signature, `exp`, `iss` and,
+    when configured, `aud`.
+
+    Attributes:
+        issuer (str): Expected `iss` claim, the realm url.
+        audience (str): Expected `aud` claim, if None the audience is not verified.
+        jwks (JWKSCache): Cache with the realm signing keys.
+        leeway (int): Seconds of clock skew tolerated when checking `exp`.
+    """
+
+    def __init__(self, keycloak_url: str, realm: str, audience: str = None, jwks_ttl: int = 3600, leeway: int = 0):
+        self.issuer = f"{keycloak_url}/realms/{realm}"
+        self.audience = audience or None
+        self.jwks = get_jwks_cache(f"{self.issuer}/protocol/openid-connect/certs", ttl=jwks_ttl)
+        self.leeway = leeway
+
+    def validate(self, token: str) -> dict:
+        """
+        Validates the token and returns its claims.
+
+        Args:
+            token (str): The bearer token.
+
+        Returns:
+            dict: The verified claims.
+
+        Raises:
+            UnknownSigningKeyError: When the token `kid` is not in the realm JWKS.
+            jwt.InvalidTokenError: When the token is malformed, expired or not issued for us.
+        """
+        logger.info("****LocalTokenValidator.validate()****")
+        header = jwt.get_unverified_header(token)
+        algorithm = header.get('alg')
+        if algorithm not in ALLOWED_ALGORITHMS:
+            raise jwt.InvalidAlgorithmError(f"Algorithm {algorithm} not allowed")
+        signing_key = self.jwks.get_signing_key(header.get('kid'))
+        return jwt.decode(
+            token,
+            signing_key.key,
+            algorithms=[algorithm],
+            audience=self.audience,
+            issuer=self.issuer,
+            leeway=self.leeway,
+            options={'verify_aud': self.audience is not None, 'require': ['exp', 'iss']}
+        )
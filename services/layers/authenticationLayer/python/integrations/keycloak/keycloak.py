@@ -3,13 +3,57 @@
 """
 #pylint: disable=line-too-long
 #pylint: disable=too-many-arguments
+import hashlib
+import time
+
+import jwt
 import requests
 
-from utils.utils_aws import AppConfig
+from utils.utils_aws import AppConfig, get_configuration
+from utils.utils_cache import TTLCache, MISSING
+from utils.utils_singleflight import SingleFlight
 from utils.logger_config import setup_logger
+from . import keycloak_http
+from .jwks import LocalTokenValidator, UnknownSigningKeyError
+from .token_manager import TOKEN_MANAGER
 
 logger = setup_logger(__name__)
 
+SESSION_CACHE = TTLCache(
+    maxsize=get_configuration().keycloak_session_cache_size,
+    ttl=get_configuration().keycloak_session_cache_ttl
+)
+
+
+def hash_token(token: str) -> str:
+    """Returns the key used to cache a token, the raw token is never stored"""
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+# Concurrent validations of the same token share one call to Keycloak
+SESSION_FLIGHTS = SingleFlight()
+
+__SESSION_VALIDATIONS = 0
+
+
+def get_session_cache_stats() -> dict:
+    """Returns the hit, miss and eviction counters of the session validation cache"""
+    return SESSION_CACHE.stats()
+
+
+def log_session_cache_stats():
+    """
+    Counts a session validation and logs the counters of the session validation cache once every
+    `KEYCLOAK_SESSION_STATS_INTERVAL` validations of the container, 0 disables it.
+    """
+    global __SESSION_VALIDATIONS  # pylint: disable=global-statement
+    interval = get_configuration().keycloak_session_stats_interval
+    if interval <= 0:
+        return
+    __SESSION_VALIDATIONS += 1
+    if __SESSION_VALIDATIONS % interval == 0:
+        logger.info("Session cache stats after %s validations: %s", __SESSION_VALIDATIONS, get_session_cache_stats())
+
 class Keycloak:
     """
     A utility class to manage and interact with Keycloak authentication.
@@ -37,22 +81,33 @@ class Keycloak:
         self.is_context = False
         self.refresh_token = None
 
-    def initialize_token(self, username, password, client_id='fileStorage', grant_type='password', scope='openid'):
+    def initialize_token(self, username, password, client_id='fileStorage', grant_type='password', scope='openid', reuse=True):
         """
         Initializes the token by fetching it using provided credentials.
 
+        By default the token is taken from the container token manager, so it is shared with
+        previous invocations and it is not invalidated when the context manager exits. Use
+        `reuse=False` to open a dedicated session that is logged out on exit.
+
         Args:
             username (str): The user's username.
             password (str): The user's password.
             client_id (str, optional): The client ID. Defaults to 'client_id'.
             grant_type (str, optional): Grant type for OAuth2. Defaults to 'password'.
             scope (str, optional): OAuth2 scope. Defaults to 'openid'.
+            reuse (bool, optional): Reuse the token kept by the token manager. Defaults to True.
         """
         logger.info("****initialize_token()****")
         if self.token:
             raise ValueError("An external token is already set. You cannot initialize an internal token simultaneously.")
-        self.token = self.get_token(username, password, client_id, grant_type, scope)
-
+        if not reuse or grant_type != 'password':
+            self.token = self.get_token(username, password, client_id, grant_type, scope)
+            return
+        try:
+            self.token = TOKEN_MANAGER.get_access_token(username, password, client_id, scope)
+        except requests.RequestException as err:
+            logger.error("Error fetching token: %s", err)
+            self.token = ''
 
     def __enter__(self):
         self.is_context = True
@@ -69,30 +124,130 @@ class Keycloak:
         """
         Validates the session using the provided token.
 
+        When `KEYCLOAK_VALIDATION_MODE` is `local` the token is verified in process against the
+        realm JWKS and Keycloak is only called when the signing key is unknown (and
+        `KEYCLOAK_USERINFO_FALLBACK` is enabled) or the token carries no `sub`.
+
+        Results are cached in the container by token hash: valid sessions until the token `exp`
+        (at most `KEYCLOAK_SESSION_CACHE_TTL` seconds) and invalid ones for
+        `KEYCLOAK_SESSION_NEGATIVE_TTL` seconds. Errors reaching Keycloak are not cached.
+        Concurrent validations of the same token are coalesced into one.
+
         Returns:
             str: User ID if session is valid, otherwise None.
         """
         logger.info("****validate_session()****")
+        if not self.token:
+            return None
+        cache_key = hash_token(self.token)
+        user_id = SESSION_CACHE.get(cache_key, MISSING)
+        if user_id is not MISSING:
+            logger.debug("Session found in cache")
+            return user_id
         try:
-            logger.debug("Token length = %s", len(self.token))
-            url =  self.config.keycloak_url
-            realm = self.config.keycloak_realm
-            logger.debug("Keycloak URL = %s Realm = %s" , url, realm)
-            userinfo_url = f"{url}/realms/{realm}/protocol/openid-connect/userinfo"
-            headers = {'Authorization': f'Bearer {self.token}'}
-            logger.debug("Sending request to %s ", userinfo_url)
-            info = requests.get(userinfo_url, headers=headers, timeout=30)
-            logger.debug("Received response: %s", info.text)
-            response = info.json()
-            if 'sub' in response:
-                logger.info("Valid session with sub: %s", response['sub'])
-                return response['sub']
-            logger.warning("No 'sub' field in response")
+            user_id, expires_at = SESSION_FLIGHTS.do(cache_key, self._resolve_session)
+        except Exception as err: #pylint: disable=broad-exception-caught
+            logger.error("Exception occurred while validating token session %s", str(err), exc_info=True)
             return None
+        if user_id:
+            ttl = self.config.keycloak_session_cache_ttl
+            if expires_at:
+                ttl = min(ttl, expires_at - time.time())
+            SESSION_CACHE.set(cache_key, user_id, ttl)
+        else:
+            SESSION_CACHE.set(cache_key, None, self.config.keycloak_session_negative_ttl)
+        return user_id
+
+    def _resolve_session(self):
+        """
+        Resolves the user of the token using the configured validation mode.
+
+        Returns:
+            tuple: The user ID (None when the token is invalid) and the token expiration
+                timestamp when it is known.
+
+        Raises:
+            Exception: When Keycloak could not be reached or answered an unexpected response.
+        """
+        if self.config.keycloak_validation_mode == 'local':
+            try:
+                claims = LocalTokenValidator(
+                    self.config.keycloak_url,
+                    self.config.keycloak_realm,
+                    audience=self.config.keycloak_audience,
+                    jwks_ttl=self.config.keycloak_jwks_ttl
+                ).validate(self.token)
+                if 'sub' in claims:
+                    logger.info("Valid local session with sub: %s", claims['sub'])
+                    return claims['sub'], claims['exp']
+                logger.warning("No 'sub' claim in token, validating with userinfo")
+            except UnknownSigningKeyError as err:
+                logger.warning("Unable to validate token locally: %s", str(err))
+                if not self.config.keycloak_userinfo_fallback:
+                    return None, None
+            except jwt.InvalidTokenError as err:
+                logger.warning("Invalid token: %s", str(err))
+                return None, None
+            except Exception as err: #pylint: disable=broad-exception-caught
+                logger.error("Exception occurred while validating token locally %s", str(err), exc_info=True)
+                if not self.config.keycloak_userinfo_fallback:
+                    raise
+        return self._get_userinfo_sub(), self._get_unverified_expiration()
+
+    def validate_session_userinfo(self):
+        """
+        Validates the session calling the Keycloak userinfo endpoint.
+
+        Returns:
+            str: User ID if session is valid, otherwise None.
+        """
+        logger.info("****validate_session_userinfo()****")
+        try:
+            return self._get_userinfo_sub()
         except Exception as err: #pylint: disable=broad-exception-caught
             logger.error("Exception occurred while validating token session %s", str(err), exc_info=True)
             return None
 
+    def _get_userinfo_sub(self):
+        """
+        Calls the Keycloak userinfo endpoint with the token.
+
+        Returns:
+            str: User ID if session is valid, otherwise None.
+        """
+        logger.debug("Token length = %s", len(self.token))
+        url =  self.config.keycloak_url
+        realm = self.config.keycloak_realm
+        logger.debug("Keycloak URL = %s Realm = %s" , url, realm)
+        userinfo_url = f"{url}/realms/{realm}/protocol/openid-connect/userinfo"
+        headers = {'Authorization': f'Bearer {self.token}'}
+        logger.debug("Sending request to %s ", userinfo_url)
+        info = keycloak_http.request('GET', userinfo_url, idempotent=True, headers=headers)
+        logger.debug("Received response: %s", info.text)
+        if info.status_code in (401, 403):
+            logger.warning("Session rejected by Keycloak with status %s", info.status_code)
+            return None
+        if info.status_code >= 500:
+            info.raise_for_status()
+        response = info.json()
+        if 'sub' in response:
+            logger.info("Valid session with sub: %s", response['sub'])
+            return response['sub']
+        logger.warning("No 'sub' field in response")
+        return None
+
+    def _get_unverified_expiration(self):
+        """
+        Reads the `exp` claim of a token already validated by Keycloak.
+
+        Returns:
+            int: The expiration timestamp or None if the token does not expose it.
+        """
+        try:
+            return jwt.decode(self.token, options={'verify_signature': False}).get('exp')
+        except jwt.InvalidTokenError:
+            return None
+
     def get_token(self, username, password, client_id = 'fileStorage', grant_type = 'password', scope='openid'):
         """
         Fetches and returns an access token.
@@ -111,15 +266,14 @@ class Keycloak:
         url =  self.config.keycloak_url
         realm = self.config.keycloak_realm
         try:
-            result = requests.post(f'{url}/realms/{realm}/protocol/openid-connect/token',
+            result = keycloak_http.request('POST', f'{url}/realms/{realm}/protocol/openid-connect/token',
                 data={
                     'username': username,
                     'password': password,
                     'grant_type': grant_type,
                     'client_id': client_id,
                     'scope': scope
-                },
-                timeout=30
+                }
             )
 
             self.refresh_token = result.json()['refresh_token']
@@ -145,7 +299,7 @@ class Keycloak:
             'scope': 'openid'
         }
 
-        response = requests.post(f'{url}/realms/{realm}/protocol/openid-connect/logout', headers=headers, data=data, timeout=30)
+        response = keycloak_http.request('POST', f'{url}/realms/{realm}/protocol/openid-connect/logout', idempotent=True, headers=headers, data=data)
 
         if response.status_code == 204:
             logger.info("Token invalidated successfully.")
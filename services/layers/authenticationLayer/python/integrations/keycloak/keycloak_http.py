@@ -0,0 +1,79 @@
+"""
+    File to declare the HTTP session shared by every call to Keycloak in the container
+"""
+#pylint: disable=line-too-long
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.utils_aws import get_configuration
+from utils.logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+RETRY_STATUS_CODES = (502, 503, 504)
+
+__SESSION = None
+__SESSION_LOCK = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the keep-alive session used to call Keycloak, created once per container with a
+    connection pool of `KEYCLOAK_POOL_SIZE` connections.
+
+    Returns:
+        requests.Session: The shared session.
+    """
+    global __SESSION  # pylint: disable=global-statement
+    with __SESSION_LOCK:
+        if __SESSION is None:
+            pool_size = get_configuration().keycloak_pool_size
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            __SESSION = session
+        return __SESSION
+
+
+def request(method: str, url: str, idempotent: bool = False, **kwargs) -> requests.Response:
+    """
+    Sends a request to Keycloak through the shared session.
+
+    Idempotent calls are retried up to `KEYCLOAK_MAX_RETRIES` times on connection errors,
+    timeouts and 502/503/504 responses, waiting a full-jitter exponential backoff between
+    attempts. Non idempotent calls are sent only once.
+
+    Args:
+        method (str): HTTP method.
+        url (str): Url of the request.
+        idempotent (bool, optional): Whether the call can be safely repeated. Defaults to False.
+        **kwargs: Arguments accepted by `requests.Session.request`.
+
+    Returns:
+        requests.Response: The response of the last attempt.
+
+    Raises:
+        requests.RequestException: When the last attempt could not be completed.
+    """
+    config = get_configuration()
+    kwargs.setdefault('timeout', (config.keycloak_connect_timeout, config.keycloak_read_timeout))
+    retries = config.keycloak_max_retries if idempotent else 0
+    session = get_session()
+    attempt = 0
+    while True:
+        try:
+            response = session.request(method, url, **kwargs)
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= retries:
+                return response
+            logger.warning("Keycloak answered %s for %s, retrying", response.status_code, url)
+        except (requests.ConnectionError, requests.Timeout) as err:
+            if attempt >= retries:
+                raise
+            logger.warning("Error calling Keycloak %s: %s, retrying", url, str(err))
+        time.sleep(random.uniform(0, config.keycloak_retry_backoff * (2 ** attempt)))
+        attempt += 1
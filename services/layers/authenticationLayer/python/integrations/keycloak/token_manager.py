@@ -0,0 +1,161 @@
+"""
+    File to declare the manager that reuses service account tokens across invocations
+"""
+#pylint: disable=line-too-long
+#pylint: disable=too-many-arguments
+import threading
+import time
+
+from utils.utils_aws import get_configuration
+from utils.logger_config import setup_logger
+from . import keycloak_http
+
+logger = setup_logger(__name__)
+
+
+class CachedToken:
+    """
+    Tokens returned by Keycloak for a service account.
+
+    Attributes:
+        access_token (str): The access token.
+        refresh_token (str): The refresh token, may be None.
+        expires_at (float): Epoch when the access token expires.
+        refresh_expires_at (float): Epoch when the refresh token expires, None if it does not expire.
+    """
+
+    def __init__(self, payload: dict, now: float):
+        self.access_token = payload['access_token']
+        self.refresh_token = payload.get('refresh_token')
+        self.expires_at = now + int(payload.get('expires_in', 0))
+        refresh_expires_in = int(payload.get('refresh_expires_in', 0))
+        self.refresh_expires_at = now + refresh_expires_in if refresh_expires_in else None
+
+
+class TokenManager:
+    """
+    Keeps the tokens of service accounts keyed by (client_id, username, scope) so every use of
+    the account in the container reuses them. Tokens are refreshed with the refresh_token grant
+    `refresh_skew` seconds before they expire and concurrent callers of the same key wait for a
+    single refresh.
+
+    Attributes:
+        refresh_skew (int): Seconds before the expiration when the token is refreshed.
+    """
+
+    def __init__(self, refresh_skew: int = 30):
+        self.refresh_skew = refresh_skew
+        self._tokens = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get_access_token(self, username, password, client_id='fileStorage', scope='openid'):
+        """
+        Returns a valid access token for the service account.
+
+        Args:
+            username (str): The user's username.
+            password (str): The user's password, only sent when a new session is needed.
+            client_id (str, optional): The client ID. Defaults to 'fileStorage'.
+            scope (str, optional): OAuth2 scope. Defaults to 'openid'.
+
+        Returns:
+            str: Access token.
+
+        Raises:
+            requests.RequestException: When Keycloak could not be reached.
+            KeyError: When Keycloak did not return a token.
+        """
+        logger.info("****TokenManager.get_access_token()****")
+        key = (client_id, username, scope)
+        with self._key_lock(key):
+            token = self._tokens.get(key)
+            now = time.time()
+            if token and now < token.expires_at - self.refresh_skew:
+                return token.access_token
+            if token and token.refresh_token and (token.refresh_expires_at is None or now < token.refresh_expires_at - self.refresh_skew):
+                try:
+                    token = self._request_token(client_id, {
+                        'grant_type': 'refresh_token',
+                        'refresh_token': token.refresh_token,
+                        'client_id': client_id,
+                        'scope': scope
+                    })
+                    self._tokens[key] = token
+                    return token.access_token
+                except (KeyError, ValueError) as err:
+                    logger.warning("Unable to refresh token of %s: %s", username, str(err))
+            token = self._request_token(client_id, {
+                'username': username,
+                'password': password,
+                'grant_type': 'password',
+                'client_id': client_id,
+                'scope': scope
+            })
+            self._tokens[key] = token
+            return token.access_token
+
+    def invalidate(self, username, client_id='fileStorage', scope='openid'):
+        """
+        Logs out the session of the service account and forgets its tokens.
+
+        Args:
+            username (str): The user's username.
+            client_id (str, optional): The client ID. Defaults to 'fileStorage'.
+            scope (str, optional): OAuth2 scope. Defaults to 'openid'.
+        """
+        logger.info("****TokenManager.invalidate()****")
+        key = (client_id, username, scope)
+        with self._key_lock(key):
+            token = self._tokens.pop(key, None)
+        if token and token.refresh_token:
+            self._logout(client_id, scope, token)
+
+    def invalidate_all(self):
+        """
+        Logs out every session kept by the manager. Lambda has no reliable shutdown hook, the
+        sessions left when a container is recycled end with the Keycloak session idle timeout
+        """
+        logger.info("****TokenManager.invalidate_all()****")
+        for client_id, username, scope in list(self._tokens):
+            try:
+                self.invalidate(username, client_id, scope)
+            except Exception as err: #pylint: disable=broad-exception-caught
+                logger.error("Error invalidating token of %s: %s", username, str(err))
+
+    def _key_lock(self, key) -> threading.Lock:
+        with self._lock:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def _request_token(self, client_id, data: dict) -> CachedToken:
+        config = get_configuration()
+        now = time.time()
+        result = keycloak_http.request(
+            'POST',
+            f'{config.keycloak_url}/realms/{config.keycloak_realm}/protocol/openid-connect/token',
+            data=data
+        )
+        logger.debug("Token obtained for client %s with grant %s", client_id, data['grant_type'])
+        return CachedToken(result.json(), now)
+
+    def _logout(self, client_id, scope, token: CachedToken):
+        config = get_configuration()
+        response = keycloak_http.request(
+            'POST',
+            f'{config.keycloak_url}/realms/{config.keycloak_realm}/protocol/openid-connect/logout',
+            idempotent=True,
+            headers={
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'Authorization': f'Bearer {token.access_token}'
+            },
+            data={'refresh_token': token.refresh_token, 'client_id': client_id, 'scope': scope}
+        )
+        if response.status_code == 204:
+            logger.info("Token invalidated successfully.")
+        else:
+            logger.error("Error invalidating token. Status Code:  %s , Response: %s", response.status_code, response.text)
+
+
+TOKEN_MANAGER = TokenManager(refresh_skew=get_configuration().keycloak_token_refresh_skew)
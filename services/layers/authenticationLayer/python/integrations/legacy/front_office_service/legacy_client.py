@@ -1,11 +1,25 @@
+import base64
+import datetime
+import decimal
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+
+from helpers.soap_client.circuit_breaker import get_circuit_breaker
 from helpers.soap_client.client import get_client
+from helpers.soap_client.concurrency_limiter import get_concurrency_limiter
+from helpers.soap_client.streaming import stream_records
 from utils.logger_config import setup_logger
+from utils.utils_aws import get_configuration
+from utils.utils_format import camel_case_key
 from zeep.xsd.valueobjects import CompoundValue
 from zeep.helpers import serialize_object
 
+from .response_cache import get_response_cache
+
 
 logger = setup_logger(__name__)
 
+JSON_NATIVE_TYPES = (str, int, float, bool, type(None))
+
 def soap_serializer(obj):
     """
     Serializa una respuesta del cliente SOAP a formato JSON basado en condiciones.
@@ -20,6 +34,93 @@ def soap_serializer(obj):
     return serialize_object(obj)
 
 
+def soap_to_json(obj, use_camel_case: bool = True, fields = None, datetime_format: str = None):
+    """
+    Converts a SOAP client response into JSON ready dicts and lists in a single traversal,
+    instead of `soap_serializer` followed by `convert_to_camel_case` and the value conversions.
+
+    Decimal values become float, datetime values strings (`datetime_format` or ISO 8601) and
+    bytes base64 strings.
+
+    Args:
+        obj: Response of the SOAP client (CompoundValue, list, dict or scalar).
+        use_camel_case (bool, optional): Whether the keys are converted to camel case. Defaults to True.
+        fields (iterable, optional): Original names of the fields kept in the records, the first
+            level of mappings found (the response itself or the items of a list). All by default.
+        datetime_format (str, optional): strftime format of the datetime values.
+
+    Returns:
+        dict, list or scalar: The converted response.
+    """
+    projection = frozenset(fields) if fields is not None else None
+    rename = camel_case_key if use_camel_case else str
+
+    def convert(value, projection):
+        if isinstance(value, JSON_NATIVE_TYPES):
+            return value
+        if isinstance(value, CompoundValue):
+            items = value.__values__.items()
+        elif isinstance(value, dict):
+            items = value.items()
+        elif isinstance(value, (list, tuple)):
+            return [convert(item, projection) for item in value]
+        else:
+            return json_scalar(value, datetime_format)
+        return {
+            rename(key): convert(item, None)
+            for key, item in items
+            if projection is None or key in projection
+        }
+
+    return convert(obj, projection)
+
+
+def json_scalar(value, datetime_format: str = None):
+    """
+    Converts a scalar of a SOAP response that the json module does not serialize.
+
+    Args:
+        value: The scalar.
+        datetime_format (str, optional): strftime format of the datetime values, ISO 8601 by default.
+
+    Returns:
+        The JSON serializable value, or the value itself when it has no conversion.
+    """
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, datetime.datetime) and datetime_format:
+        return value.strftime(datetime_format)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(value).decode('utf-8')
+    return value
+
+
+class CallResult:
+    """
+    Outcome of one of the operations of `LegacyClient.call_many`.
+
+    Attributes:
+        operation (str): Name of the SOAP operation.
+        value: The JSON ready response, None when the call failed.
+        error (Exception): The error of the call, None when it succeeded.
+    """
+
+    def __init__(self, operation: str, value = None, error: Exception = None):
+        self.operation = operation
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        """Whether the call succeeded"""
+        return self.error is None
+
+    def __repr__(self):
+        return f'CallResult({self.operation!r}, value={self.value!r}, error={self.error!r})'
+
+
 class LegacyClient:
     """
     This class is used to create a new instance of the H1 client.
@@ -27,6 +128,137 @@ class LegacyClient:
     def __init__(self, auth, client):
         self.auth = auth
         self.client = client
+        self.circuit_breaker = get_circuit_breaker(client.wsdl.location)
+        self.concurrency_limiter = get_concurrency_limiter(client.wsdl.location)
+
+    def call(self, operation: str, *args, **kwargs):
+        """
+        Invokes an operation of the H1 client with the session as first argument and returns the
+        response converted by `soap_to_json`. Operations listed in `LEGACY_CACHED_OPERATIONS` are
+        served from the response cache, keyed by the operation and the other arguments, so they
+        must not depend on the session.
+
+        Calls to the backend go through its concurrency limiter, which bounds the calls in flight
+        to what the backend answers without slowing down, and its circuit breaker, which shortens
+        the timeout to the observed latency of the operation and fails fast while the backend is
+        failing.
+
+        Args:
+            operation (str): Name of the SOAP operation.
+            *args: Arguments of the operation after the session.
+            **kwargs: Keyword arguments of the operation.
+
+        Returns:
+            dict, list or scalar: The JSON ready response.
+
+        Raises:
+            CircuitOpenError: When the circuit breaker of the backend is open.
+            ConcurrencyLimitExceeded: When the backend has too many calls in flight.
+        """
+        logger.info("****LegacyClient.call()****")
+
+        def load():
+            transport = self.client.transport
+            with self.concurrency_limiter.slot(operation):
+                timeout = self.circuit_breaker.timeout(transport.operation_timeout, operation)
+                with self.circuit_breaker.guard(operation), transport.settings(timeout=timeout):
+                    response = self.client.service[operation](self.auth, *args, **kwargs)
+            return soap_to_json(response)
+
+        return get_response_cache().get_or_load(
+            operation, [self.client.wsdl.location, args, kwargs], load
+        )
+
+    def response_version(self, operation: str, *args, **kwargs):
+        """
+        Returns the version of the cached response of a `call`, which changes when the response
+        is loaded again from the backend.
+
+        Args:
+            operation (str): Name of the SOAP operation.
+            *args: Arguments of the operation after the session.
+            **kwargs: Keyword arguments of the operation.
+
+        Returns:
+            str: The version, None when the operation is not cached or not loaded yet.
+        """
+        return get_response_cache().version(operation, [self.client.wsdl.location, args, kwargs])
+
+    def stream(self, operation: str, record_tag: str, *args, fields = None, **kwargs):
+        """
+        Invokes a list shaped operation with the session as first argument and yields its
+        `record_tag` records converted by `soap_to_json` one at a time, without holding the whole
+        response in memory. Use it for large result sets that are filtered, projected or paginated.
+
+        The stream holds a slot of the concurrency limiter and goes through the circuit breaker
+        until it is consumed or closed, its duration does not feed the adaptive timeouts.
+
+        Args:
+            operation (str): Name of the SOAP operation.
+            record_tag (str): Local name of the repeated element of the response.
+            *args: Arguments of the operation after the session.
+            fields (iterable, optional): Original names of the fields kept in every record.
+            **kwargs: Keyword arguments of the operation.
+
+        Yields:
+            dict: Every record of the response.
+
+        Raises:
+            CircuitOpenError: When the circuit breaker of the backend is open.
+            ConcurrencyLimitExceeded: When the backend has too many calls in flight.
+        """
+        logger.info("****LegacyClient.stream()****")
+        with self.concurrency_limiter.slot(), self.circuit_breaker.guard():
+            for record in stream_records(self.client, operation, record_tag, self.auth, *args, **kwargs):
+                yield soap_to_json(record, fields=fields)
+
+    def call_many(self, calls, max_workers: int = None, timeout: float = None, call_timeout: float = None) -> list:
+        """
+        Invokes several operations concurrently with `call`, so the latency is the one of the
+        slowest operation instead of the sum of all of them.
+
+        Args:
+            calls (list): (operation, args) pairs, args being the arguments after the session.
+            max_workers (int, optional): Maximum concurrent calls, `LEGACY_MAX_WORKERS` by default.
+            timeout (float, optional): Seconds to wait for the whole batch, the calls that are
+                not done by then fail with TimeoutError.
+            call_timeout (float, optional): Seconds each operation waits for the SOAP backend.
+
+        Returns:
+            list: A CallResult per call, in the order of `calls`.
+        """
+        logger.info("****LegacyClient.call_many()****")
+        calls = [(operation, tuple(args or ())) for operation, args in calls]
+        if not calls:
+            return []
+        max_workers = min(len(calls), max_workers or get_configuration().legacy_max_workers)
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='legacy-call')
+        futures = [
+            executor.submit(self._call_with_timeout, operation, args, call_timeout)
+            for operation, args in calls
+        ]
+        wait(futures, timeout=timeout)
+        executor.shutdown(wait=False)
+        results = []
+        for (operation, _), future in zip(calls, futures):
+            if not future.done():
+                future.cancel()
+                logger.error("Operation %s not done after %s seconds", operation, timeout)
+                results.append(CallResult(operation, error=FutureTimeoutError(
+                    f'{operation} not done after {timeout} seconds'
+                )))
+            elif future.exception() is not None:
+                logger.error("Error calling operation %s: %s", operation, future.exception())
+                results.append(CallResult(operation, error=future.exception()))
+            else:
+                results.append(CallResult(operation, value=future.result()))
+        return results
+
+    def _call_with_timeout(self, operation: str, args: tuple, call_timeout: float = None):
+        if call_timeout is None:
+            return self.call(operation, *args)
+        with self.client.transport.settings(timeout=call_timeout):
+            return self.call(operation, *args)
 
 
 class LegacyFactory:
@@ -50,3 +282,19 @@ class LegacyFactory:
         except ValueError as val_err:
             logger.error(f"Error creating instance to H1 client: {val_err}")
             raise ValueError("Invalid client_version for H1") from val_err
+
+    @staticmethod
+    def call_many(auth, client_version, calls, **options) -> list:
+        """
+        This function invokes several operations of the H1 client concurrently.
+
+        Args:
+            auth (Authentication): An instance of the Authentication class.
+            client_version (str): The version of the SOAP API client to use.
+            calls (list): (operation, args) pairs, args being the arguments after the session.
+            **options: max_workers, timeout and call_timeout of `LegacyClient.call_many`.
+
+        Returns:
+            list: A CallResult per call, in the order of `calls`.
+        """
+        return LegacyFactory.create_client(auth, client_version).call_many(calls, **options)
@@ -0,0 +1,295 @@
+"""
+Cache of the responses of the legacy SOAP operations opted in with `LEGACY_CACHED_OPERATIONS`,
+a comma separated list of `operation:ttl[:stale]` entries, e.g. `GetGlobalAttribute:3600:300`.
+
+Entries are kept in two tiers:
+    - local: TTLCache of the lambda container.
+    - shared: optional DynamoDB table (`LEGACY_RESPONSE_CACHE_TABLE`) with `cacheKey` as partition
+      key, whose records are removed by the table TTL on the `ttl` attribute, set at least
+      TTL_DYNAMO_RECORDS seconds ahead like the other records of the project.
+
+A response is fresh for the ttl of its operation and is served stale for `stale` more seconds while
+a background refresh replaces it. The refresh runs in a thread of the container, which Lambda
+freezes once the invocation returns, so it may only complete during a later invocation of the same
+container; until then the stale response keeps being served, at most until `stale` runs out.
+
+Only responses accepted by the validator of their operation (`register_cacheable`) are stored, by
+default any response but None, so an unexpected payload is not shared for the whole ttl.
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Callable, Optional
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+
+from utils.logger_config import setup_logger
+from utils.utils_aws import get_configuration
+from utils.utils_cache import TTLCache
+from utils.utils_singleflight import SingleFlight
+
+logger = setup_logger(__name__)
+
+__RESPONSE_CACHE = None
+__RESPONSE_CACHE_LOCK = threading.Lock()
+__CACHEABLE = {}
+
+
+def register_cacheable(operation: str, cacheable: Callable):
+    """
+    Registers the validator of the responses of an operation that may be cached.
+
+    Args:
+        operation (str): Name of the SOAP operation.
+        cacheable (Callable): Function that receives the JSON ready response and returns whether
+            it is stored.
+    """
+    __CACHEABLE[operation] = cacheable
+
+
+def is_cacheable(operation: str, value) -> bool:
+    """
+    Returns whether a response of the operation may be stored in the cache.
+
+    Args:
+        operation (str): Name of the SOAP operation.
+        value: The JSON ready response.
+
+    Returns:
+        bool: The result of the registered validator, whether the response is not None otherwise.
+    """
+    cacheable = __CACHEABLE.get(operation)
+    if cacheable is None:
+        return value is not None
+    return bool(cacheable(value))
+
+
+def parse_cached_operations(value: str) -> dict:
+    """
+    Parses the `LEGACY_CACHED_OPERATIONS` setting.
+
+    Args:
+        value (str): Comma separated `operation:ttl[:stale]` entries.
+
+    Returns:
+        dict: The (ttl, stale) seconds of every operation.
+    """
+    policies = {}
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        operation, *seconds = [part.strip() for part in entry.split(':')]
+        try:
+            ttl = int(seconds[0]) if seconds else 0
+            stale = int(seconds[1]) if len(seconds) > 1 else 0
+        except ValueError:
+            logger.error("Invalid cached operation entry: %s", entry)
+            continue
+        if ttl > 0:
+            policies[operation] = (ttl, max(stale, 0))
+    return policies
+
+
+def cache_key(operation: str, arguments) -> str:
+    """
+    Builds the key of a response from its operation and its arguments.
+
+    Args:
+        operation (str): Name of the SOAP operation.
+        arguments: JSON serializable arguments that identify the response, without the session.
+
+    Returns:
+        str: The operation followed by the hash of the arguments.
+    """
+    arguments_hash = hashlib.sha256(
+        json.dumps(arguments, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+    return f'{operation}:{arguments_hash}'
+
+
+class CachedResponse:
+    """
+    Response stored in the cache.
+
+    Attributes:
+        value: The JSON ready response.
+        fresh_until (float): Epoch until the response is served without refreshing it.
+        stale_until (float): Epoch until the response is served while it is refreshed.
+    """
+
+    def __init__(self, value, fresh_until: float, stale_until: float):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class LegacyResponseCache:
+    """
+    Two tier cache of the responses of the opted in operations.
+
+    Attributes:
+        policies (dict): The (ttl, stale) seconds of every cached operation.
+        local_cache (TTLCache): Tier of the container.
+        table_name (str): DynamoDB table of the shared tier, no shared tier when empty.
+    """
+
+    def __init__(self, policies: dict, maxsize: int = 256, table_name: str = ''):
+        self.policies = policies
+        self.local_cache = TTLCache(maxsize=maxsize)
+        self.table_name = table_name
+        self._table = None
+        self._flights = SingleFlight()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get_or_load(self, operation: str, arguments, loader: Callable):
+        """
+        Returns the cached response of the operation, calling `loader` when there is no usable
+        response or the operation is not cached. Concurrent misses of the same key share one call,
+        and responses rejected by `is_cacheable` are returned without being stored.
+
+        Args:
+            operation (str): Name of the SOAP operation.
+            arguments: JSON serializable arguments that identify the response, without the session.
+            loader (Callable): Function without arguments that calls the operation and returns
+                the JSON ready response.
+
+        Returns:
+            The response of the operation.
+        """
+        policy = self.policies.get(operation)
+        if policy is None:
+            return loader()
+        key = cache_key(operation, arguments)
+        entry = self._get(key)
+        now = time.time()
+        if entry is not None:
+            if now < entry.fresh_until:
+                logger.debug("Legacy response cache HIT for %s", operation)
+                return entry.value
+            if now < entry.stale_until:
+                logger.debug("Legacy response cache STALE for %s", operation)
+                self._refresh_in_background(operation, key, policy, loader)
+                return entry.value
+        logger.debug("Legacy response cache MISS for %s", operation)
+        return self._flights.do(key, self._load, operation, key, policy, loader)
+
+    def version(self, operation: str, arguments) -> Optional[str]:
+        """
+        Returns a token of the cached response of the operation that changes every time the
+        response is loaded again, meant to be used as ETag version.
+
+        Args:
+            operation (str): Name of the SOAP operation.
+            arguments: JSON serializable arguments that identify the response, without the session.
+
+        Returns:
+            str: The token, None when the operation is not cached or has no usable response.
+        """
+        if operation not in self.policies:
+            return None
+        key = cache_key(operation, arguments)
+        entry = self._get(key)
+        if entry is None or time.time() >= entry.stale_until:
+            return None
+        return f'{key}:{int(entry.fresh_until)}'
+
+    def _load(self, operation: str, key: str, policy: tuple, loader: Callable):
+        value = loader()
+        if is_cacheable(operation, value):
+            self._store(key, policy, value)
+        else:
+            logger.warning("Legacy response of %s not cached, rejected by its validator", operation)
+        return value
+
+    def _get(self, key: str) -> Optional[CachedResponse]:
+        entry = self.local_cache.get(key)
+        if entry is None and self.table_name:
+            entry = self._get_shared(key)
+            if entry is not None:
+                self.local_cache.set(key, entry, entry.stale_until - time.time())
+        return entry
+
+    def _store(self, key: str, policy: tuple, value):
+        ttl, stale = policy
+        now = time.time()
+        entry = CachedResponse(value, now + ttl, now + ttl + stale)
+        self.local_cache.set(key, entry, ttl + stale)
+        if self.table_name:
+            self._put_shared(key, entry)
+
+    def _refresh_in_background(self, operation: str, key: str, policy: tuple, loader: Callable):
+        # Best effort: Lambda freezes the thread between invocations, see the module docstring
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._flights.do(key, self._load, operation, key, policy, loader)
+            except Exception as error:  # pylint: disable=broad-except
+                logger.warning("Unable to refresh the legacy response %s: %s", key, error)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name='legacy-cache-refresh', daemon=True).start()
+
+    def _get_table(self):
+        if self._table is None:
+            self._table = boto3.resource(
+                'dynamodb', region_name=get_configuration().region_name
+            ).Table(self.table_name)
+        return self._table
+
+    def _get_shared(self, key: str) -> Optional[CachedResponse]:
+        try:
+            item = self._get_table().get_item(Key={'cacheKey': key}).get('Item')
+        except (BotoCoreError, ClientError) as error:
+            logger.warning("Unable to read the shared legacy response cache: %s", error)
+            return None
+        if not item or float(item['staleUntil']) <= time.time():
+            return None
+        return CachedResponse(json.loads(item['payload']), float(item['freshUntil']), float(item['staleUntil']))
+
+    def _put_shared(self, key: str, entry: CachedResponse):
+        try:
+            payload = json.dumps(entry.value)
+        except (TypeError, ValueError) as error:
+            logger.warning("Legacy response %s is not JSON serializable: %s", key, error)
+            return
+        expires_at = int(max(entry.stale_until, time.time() + int(get_configuration().ttl_dynamo_records)))
+        try:
+            self._get_table().put_item(Item={
+                'cacheKey': key,
+                'payload': payload,
+                'freshUntil': int(entry.fresh_until),
+                'staleUntil': int(entry.stale_until),
+                'ttl': expires_at,
+            })
+        except (BotoCoreError, ClientError) as error:
+            logger.warning("Unable to write the shared legacy response cache: %s", error)
+
+
+def get_response_cache() -> LegacyResponseCache:
+    """
+    Returns the response cache of the container, configured with `LEGACY_CACHED_OPERATIONS`,
+    `LEGACY_RESPONSE_CACHE_SIZE` and `LEGACY_RESPONSE_CACHE_TABLE`.
+
+    Returns:
+        LegacyResponseCache: The shared cache.
+    """
+    global __RESPONSE_CACHE  # pylint: disable=global-statement
+    if __RESPONSE_CACHE is None:
+        with __RESPONSE_CACHE_LOCK:
+            if __RESPONSE_CACHE is None:
+                configuration = get_configuration()
+                __RESPONSE_CACHE = LegacyResponseCache(
+                    parse_cached_operations(configuration.legacy_cached_operations),
+                    maxsize=configuration.legacy_response_cache_size,
+                    table_name=configuration.legacy_response_cache_table
+                )
+    return __RESPONSE_CACHE
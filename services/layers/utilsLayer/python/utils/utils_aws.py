@@ -34,6 +34,34 @@ class AppConfig:
         self.reporting_services_bucket_name = os.environ.get("REPORTING_SERVICES_BUCKET_NAME", "")
         self.keycloak_url = os.environ.get('BASE_API_REST_KEYCLOAK', '')
         self.keycloak_realm = os.environ.get('REALM_KEYCLOAK')
+        self.keycloak_validation_mode = os.environ.get('KEYCLOAK_VALIDATION_MODE', 'userinfo')
+        self.keycloak_audience = os.environ.get('KEYCLOAK_AUDIENCE', '')
+        self.keycloak_jwks_ttl = int(os.environ.get('KEYCLOAK_JWKS_TTL', '3600'))
+        self.keycloak_userinfo_fallback = os.environ.get(
+            'KEYCLOAK_USERINFO_FALLBACK', 'true'
+        ).lower() == 'true'
+        self.keycloak_session_cache_size = int(os.environ.get('KEYCLOAK_SESSION_CACHE_SIZE', '1024'))
+        self.keycloak_session_cache_ttl = int(os.environ.get('KEYCLOAK_SESSION_CACHE_TTL', '300'))
+        self.keycloak_session_negative_ttl = int(os.environ.get('KEYCLOAK_SESSION_NEGATIVE_TTL', '5'))
+        self.keycloak_session_stats_interval = int(os.environ.get('KEYCLOAK_SESSION_STATS_INTERVAL', '100'))
+        self.keycloak_pool_size = int(os.environ.get('KEYCLOAK_POOL_SIZE', '10'))
+        self.keycloak_connect_timeout = float(os.environ.get('KEYCLOAK_CONNECT_TIMEOUT', '3.05'))
+        self.keycloak_read_timeout = float(os.environ.get('KEYCLOAK_READ_TIMEOUT', '10'))
+        self.keycloak_max_retries = int(os.environ.get('KEYCLOAK_MAX_RETRIES', '2'))
+        self.keycloak_retry_backoff = float(os.environ.get('KEYCLOAK_RETRY_BACKOFF', '0.1'))
+        self.keycloak_token_refresh_skew = int(os.environ.get('KEYCLOAK_TOKEN_REFRESH_SKEW', '30'))
+        self.credentials_cache_size = int(os.environ.get('CREDENTIALS_CACHE_SIZE', '256'))
+        self.credentials_cache_ttl = int(os.environ.get('CREDENTIALS_CACHE_TTL', '30'))
+        self.credentials_negative_cache_ttl = int(os.environ.get('CREDENTIALS_NEGATIVE_CACHE_TTL', '5'))
+        self.session_lookup_mode = os.environ.get('SESSION_LOOKUP_MODE', 'query')
+        self.session_lookup_table = os.environ.get('SESSION_LOOKUP_TABLE', '')
+        self.session_lookup_consistent_read = os.environ.get(
+            'SESSION_LOOKUP_CONSISTENT_READ', 'false'
+        ).lower() == 'true'
+        self.session_lookup_fallback = os.environ.get('SESSION_LOOKUP_FALLBACK', 'true').lower() == 'true'
+        self.session_index_sorted_by_creation = os.environ.get(
+            'SESSION_INDEX_SORTED_BY_CREATION', 'false'
+        ).lower() == 'true'
         self.test_auth_user = os.environ.get('TEST_AUTH_USER', '')
         self.test_auth_password = os.environ.get('TEST_AUTH_PASSWORD', '')
         self.env_name = os.environ.get('ENVIRONMENT_VAR', '')
@@ -47,6 +75,15 @@ class AppConfig:
         self.ssm_general_billpayment  = os.environ.get("GENERAL_BILLPAYMENT_SERVICE ", '')
         self.collection_payments_wsdl = os.environ.get("COLLECTION_PAYMENTS_WSDL", '')
         self.ttl_dynamo_records = os.environ.get("TTL_DYNAMO_RECORDS", '1800')
+        self.legacy_cached_operations = os.environ.get('LEGACY_CACHED_OPERATIONS', '')
+        self.legacy_response_cache_size = int(os.environ.get('LEGACY_RESPONSE_CACHE_SIZE', '256'))
+        self.legacy_response_cache_table = os.environ.get('LEGACY_RESPONSE_CACHE_TABLE', '')
+        self.legacy_max_workers = int(os.environ.get('LEGACY_MAX_WORKERS', '10'))
+        self.response_offload_bucket = os.environ.get('RESPONSE_OFFLOAD_BUCKET', '')
+        self.response_offload_prefix = os.environ.get('RESPONSE_OFFLOAD_PREFIX', 'responses/')
+        self.response_offload_min_bytes = int(os.environ.get('RESPONSE_OFFLOAD_MIN_BYTES', '0'))
+        self.stepfunction_offload_min_bytes = int(os.environ.get('STEPFUNCTION_OFFLOAD_MIN_BYTES', '250000'))
+        self.response_offload_url_ttl = int(os.environ.get('RESPONSE_OFFLOAD_URL_TTL', '900'))
 
 def get_configuration() -> AppConfig:
     """Returns an application configuration object"""
@@ -276,6 +313,45 @@ def upload_to_s3(bucket_name, file_name, file_obj, content_type):
         return False
 
 
+def generate_presigned_url(bucket_name: str, file_name: str, expires_in: int = 900) -> Optional[str]:
+    """Function to generate a temporary url to download a file of a bucket.
+    Args:
+        bucket_name (str): Name of the bucket of the file
+        file_name (str): Key of the file
+        expires_in (int): Seconds the url is valid
+
+    Returns:
+        str: The presigned GET url, None when it could not be generated
+    """
+    logger.info("****utils_aws.generate_presigned_url()****")
+    s3 = boto3.client('s3')
+
+    try:
+        return s3.generate_presigned_url(
+            'get_object', Params={'Bucket': bucket_name, 'Key': file_name}, ExpiresIn=expires_in
+        )
+    except Exception as err:  # pylint: disable=broad-except
+        logger.error('Error al generar la url de S3: %s', str(err))
+        return None
+
+
+def read_s3_object(bucket_name: str, file_name: str) -> bytes:
+    """Function to read the content of a file of a bucket.
+    Args:
+        bucket_name (str): Name of the bucket of the file
+        file_name (str): Key of the file
+
+    Returns:
+        bytes: The content of the file
+
+    Raises:
+        ClientError: When the file does not exist or can not be read
+    """
+    logger.info("****utils_aws.read_s3_object()****")
+    s3 = boto3.client('s3')
+    return s3.get_object(Bucket=bucket_name, Key=file_name)['Body'].read()
+
+
 def fetch_content_s3_file(bucket_name: str, file_name: str):
     """ Method to read the s3 file content
 
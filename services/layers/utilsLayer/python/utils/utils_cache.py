@@ -0,0 +1,113 @@
+"""
+Utils for in-process caches that live as long as the lambda container
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from .logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Bounded LRU cache where every entry expires after its own time to live.
+
+    Attributes:
+        maxsize (int): Maximum number of entries, the least recently used entry is evicted
+            when it is exceeded.
+        ttl (float): Default time to live in seconds of the entries.
+        hits (int): Number of lookups that found a live entry.
+        misses (int): Number of lookups that did not find a live entry.
+        evictions (int): Number of entries removed to respect `maxsize`.
+        expirations (int): Number of entries removed because they were expired.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Returns the value stored for the key if it is not expired.
+
+        Args:
+            key (Hashable): The key of the entry.
+            default (Any): Value returned when there is no live entry.
+
+        Returns:
+            Any: The cached value or the default.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Stores a value, entries with a non positive ttl are not stored.
+
+        Args:
+            key (Hashable): The key of the entry.
+            value (Any): The value to store.
+            ttl (float, optional): Seconds to keep the entry, defaults to the cache ttl.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        """Removes the entry of the key if it exists"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes all the entries, the counters are kept"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the cache, useful to size it.
+
+        Returns:
+            dict: hits, misses, evictions, expirations, size and maxsize.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
@@ -11,24 +11,43 @@ import calendar
 from dateutil import tz
 import datetime
 import decimal
+import functools
+import hashlib
 import json
 import os
 import re
+import uuid
 from typing import Any, Optional
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
 from .logger_config import setup_logger
 
 logger = setup_logger(__name__)
 
+# Distinct keys whose conversion is kept by every key case converter
+KEY_CACHE_SIZE = int(os.environ.get('KEY_CACHE_SIZE', '4096'))
+
+# Lambda rejects synchronous responses larger than 6 MB
+LAMBDA_RESPONSE_LIMIT = 6 * 1024 * 1024
+# Items of a list serialized to estimate the size of the whole list
+SIZE_ESTIMATE_SAMPLES = 16
+
 RESPONSE_CODES = {
     200: 'sucessfull',
     201: 'sucessfull creation',
     202: 'sucessfull accepted',
+    304: 'Not Modified',
     422: 'unprocessable entity',
     404: 'NOT FOUND',
     400: 'Bad Request',
     401: 'Unauthorized',
-    500: 'Internal Server Error'
+    429: 'Too Many Requests',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable'
 }
 
 def return_formatted_response(
@@ -37,6 +56,8 @@ def return_formatted_response(
     data: Any,
     message_given: str = '',
     use_camel_case: bool = False,
+    event: Optional[dict] = None,
+    etag_version: Optional[str] = None,
 ):
     """
     _summary_
@@ -47,6 +68,18 @@ def return_formatted_response(
         data (Any): You must provide all the data to be sent through the body of the response
         message_given (str): Additional message that is added to the message of the http method
         use_camel_case (bool): Indicates if the response should be in camel case.
+        event (dict, optional): The API Gateway event, when given successful GET and HEAD
+            responses get an `ETag`, answered with a bodiless 304 when it matches the
+            `If-None-Match` of the request.
+        etag_version (str, optional): Token that changes with the data, e.g. a cache generation,
+            hashed with the other arguments that shape the body as ETag instead of the hash of
+            the body, so a 304 is answered without serializing the data.
+
+    The body is serialized by the backend selected with `JSON_BACKEND`, which also handles
+    Decimal, datetime and bytes values. With `use_camel_case` the keys are renamed and those
+    values converted in a single traversal. With `RESPONSE_OFFLOAD_BUCKET` set, bodies of
+    `RESPONSE_OFFLOAD_MIN_BYTES` or more, and bodies that do not fit the Lambda limit, are
+    uploaded to S3 and answered with a presigned url (see `offload_response`).
 
     Returns:
         dict: Formatted Response
@@ -65,10 +98,33 @@ def return_formatted_response(
         if not headers
         else headers
     )
-    data = data if not use_camel_case else convert_to_camel_case(data)
+    conditional = event is not None and status == 200 and event.get('httpMethod') in ('GET', 'HEAD')
+    backend = get_json_backend()
+    etag = None
+    if conditional and etag_version is not None:
+        etag = compute_etag('\n'.join((
+            etag_version, str(status), message_given, str(use_camel_case),
+            backend.name, backend.decimal_mode, backend.datetime_format
+        )))
+        if etag_matches(get_request_header(event, 'If-None-Match'), etag):
+            return not_modified_response(headers, etag)
+    data = data if not use_camel_case else backend.camel_case_normalizer.transform(data)
     body = {'status': status, 'message': message, 'data': data}
 
-    return {'headers': headers, 'statusCode': status, 'body': json.dumps(body)}
+    response = {'headers': headers, 'statusCode': status, 'body': backend.dumps(body)}
+    if conditional:
+        etag = etag or compute_etag(response['body'])
+        if etag_matches(get_request_header(event, 'If-None-Match'), etag):
+            return not_modified_response(headers, etag)
+        response['headers'] = {**headers, 'ETag': etag}
+    configuration = _offload_configuration()
+    if configuration is not None and configuration.response_offload_min_bytes \
+            and len(response['body']) >= configuration.response_offload_min_bytes:
+        return offload_response(response)
+    # API Gateway compresses the body (minimumCompressionSize), the limit applies to it as it is
+    if not _fits_response_limit(response):
+        response = _response_too_large(response)
+    return response
 
 def convert_to_camel_case(data):
     """
@@ -81,18 +137,24 @@ def convert_to_camel_case(data):
         dict, list, or any: The converted dictionary.
 
     """
-    if isinstance(data, dict):
-        new_dict = {}
-        for key, value in data.items():
-            words = key.split('_')
-            new_key = words[0] + ''.join(word.capitalize() for word in words[1:])
-            if new_key[0].isupper():
-                new_key = new_key[0].lower() + new_key[1:]
-            new_dict[new_key] = convert_to_camel_case(value)
-        return new_dict
-    if isinstance(data, list):
-        return [convert_to_camel_case(item) for item in data]
-    return data
+    return CAMEL_CASE_NORMALIZER.transform(data)
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def camel_case_key(key: str) -> str:
+    """
+    Convert a single key from snake_case or PascalCase to camelCase.
+
+    Args:
+        key (str): The key to convert.
+
+    Returns:
+        str: The key in camel case.
+    """
+    words = key.split('_')
+    new_key = words[0] + ''.join(word.capitalize() for word in words[1:])
+    if new_key and new_key[0].isupper():
+        new_key = new_key[0].lower() + new_key[1:]
+    return new_key
 
 def return_formatted_response_stepfunction(
     status: int,
@@ -108,14 +170,29 @@ def return_formatted_response_stepfunction(
         message_given (str): Additional message that is added to the message of the http method
         use_camel_case (bool): Indicates if response should be camel case
 
+    With `RESPONSE_OFFLOAD_BUCKET` set, responses of `STEPFUNCTION_OFFLOAD_MIN_BYTES` or more
+    are uploaded to S3 and replaced by an `offload` pointer without data, read them with
+    `load_offloaded_payload`. The response is only serialized when an estimate of its size,
+    from a sample of its lists, reaches half the threshold.
+
     Returns:
         dict: Formatted Response
     """
     logger.info("****return_formatted_response_stepfunction()****")
     message = RESPONSE_CODES.get(status, 'Internal Server Error')
     message = message + ' ' + message_given
-    data = data if not use_camel_case else convert_to_camel_case(data)
-    return {'status': status, 'message': message, 'data': data}
+    data = data if not use_camel_case else get_json_backend().camel_case_normalizer.transform(data)
+    response = {'status': status, 'message': message, 'data': data}
+    configuration = _offload_configuration()
+    min_bytes = configuration.stepfunction_offload_min_bytes if configuration is not None else 0
+    # Sampled estimate, the margin keeps an underestimate from reaching the state limit
+    if min_bytes and estimate_json_size(response) * 2 >= min_bytes:
+        body = get_json_backend().dumps(response).encode('utf-8')
+        if len(body) >= min_bytes:
+            pointer = offload_payload(body)
+            if pointer is not None:
+                return {'status': status, 'message': message, 'data': None, 'offload': pointer}
+    return response
 
 def return_formatted_response_error_when_missing_key(missing_key: str) -> dict:
     """
@@ -142,15 +219,9 @@ def change_data_type(data, current_type, new_type):
     Returns:
         any: The 'data' data structure with the values changed to the specified new data type.
     """
-    if isinstance(data, current_type):
-        return new_type(data)
-    if isinstance(data, list):
-        return [change_data_type(i, current_type, new_type) for i in data]
-    if isinstance(data, tuple):
-        return tuple(change_data_type(i, current_type, new_type) for i in data)
-    if isinstance(data, dict):
-        return {k: change_data_type(v, current_type, new_type) for k, v in data.items()}
-    return data
+    return ResponseNormalizer(
+        value_rules=[(current_type, new_type)], sequence_types=(list, tuple)
+    ).transform(data)
 
 def create_customer_from_json(customer_str: str):
     """_summary_
@@ -264,27 +335,7 @@ def reformat_camel_case_init_char(data):
 
     """
     logger.info("****reformat_camel_case_init_char()****")
-    if isinstance(data, dict):
-        transformed_dict = {}
-        for key, value in data.items():
-            if isinstance(value, (dict, list)):
-                transformed_value = reformat_camel_case_init_char(value)
-            else:
-                transformed_value = value
-
-            transformed_key = key[0].upper() + key[1:]
-            transformed_dict[transformed_key] = transformed_value
-
-        return transformed_dict
-
-    if isinstance(data, list):
-        transformed_list = []
-        for item in data:
-            transformed_item = reformat_camel_case_init_char(item)
-            transformed_list.append(transformed_item)
-
-        return transformed_list
-    return data
+    return UPPER_INIT_CHAR_NORMALIZER.transform(data)
 
 def get_current_time_utc():
     """get current time
@@ -363,6 +414,7 @@ def datetime_to_ms(date: datetime, timezone: Optional[str] = None) -> int:
 
 
 
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
 def camel_to_pascal(key_name:str):
     """
     This function converts a string from camelCase to PascalCase.
@@ -389,11 +441,7 @@ def keys_camel_to_pascal(input_dict):
     Returns:
         dict: dict with all keys in PascalCase
     """
-    pascal_case_dict = {}
-    for key, value in input_dict.items():
-        pascal_case_key = camel_to_pascal(key)
-        pascal_case_dict[pascal_case_key] = value
-    return pascal_case_dict
+    return PASCAL_CASE_KEYS_NORMALIZER.transform(input_dict)
 
 
 def clean_body_strings(body: dict) -> dict:
@@ -407,14 +455,7 @@ def clean_body_strings(body: dict) -> dict:
         body: json request with clean strings
     """
     logger.info("****clean_body_strings()****")
-    for key in body:
-        element = body[key]
-        if isinstance(element, str):
-            clean_string = re.sub(r'\s+', ' ', element).strip()
-            body[key] = clean_string
-        elif isinstance(element, dict):
-            clean_body_strings(element)
-    return body
+    return CLEAN_STRINGS_NORMALIZER.transform(body)
 
 
 def datetime_instances_parser(obj, datetime_format):
@@ -433,23 +474,12 @@ def datetime_instances_parser(obj, datetime_format):
     if not isinstance(datetime_format, str):
         raise ValueError('Datetime format must be a string')
 
-    # Recursively parse object
-    def recursive_parser(obj):
-        if isinstance(obj, dict):
-            for key, value in list(obj.items()):
-                if isinstance(value, datetime.datetime):
-                    obj[key] = convert_date_to_string(value, datetime_format)
-                elif isinstance(value, (list, dict)):
-                    obj[key] = recursive_parser(value)
-        elif isinstance(obj, list):
-            for idx, item in enumerate(obj):
-                if isinstance(item, datetime.datetime):
-                    obj[idx] = convert_date_to_string(item, datetime_format)
-                elif isinstance(item, (list, dict)):
-                    obj[idx] = recursive_parser(item)
+    if not isinstance(obj, (dict, list)):
         return obj
-
-    return recursive_parser(obj)
+    return ResponseNormalizer(
+        value_rules=[(datetime.datetime, lambda value: convert_date_to_string(value, datetime_format))],
+        in_place=True
+    ).transform(obj)
 
 
 def convert_bytes_to_json_serializable(data: dict) -> dict:
@@ -462,10 +492,665 @@ def convert_bytes_to_json_serializable(data: dict) -> dict:
         data: dictionary with string values
     """
     logger.info("****convert_bytes_to_json_serializable()****")
-    for key in data:
-        element = data[key]
-        if isinstance(element, bytes):
-            data[key] = base64.b64encode(element).decode('utf-8')
-        elif isinstance(element, dict):
-            convert_bytes_to_json_serializable(element)
-    return data
\ No newline at end of file
+    return BYTES_TO_BASE64_NORMALIZER.transform(data)
+
+class ResponseNormalizer:
+    """
+    Applies a set of key and value rules to a payload in a single iterative traversal, instead of
+    one recursive walk per rule. Nesting depth is only bounded by memory.
+
+    Value rules are (types, function) pairs checked before descending into a node, the first rule
+    whose types match the node replaces it and the result is not traversed. Rules also match dicts
+    and sequences, so a container can be replaced as a whole.
+
+    Attributes:
+        key_rule (callable): Function applied to the keys of the dicts, None keeps them.
+        value_rules (tuple): (types, function) pairs applied to the values.
+        in_place (bool): Whether dicts and lists are modified instead of copied.
+        sequence_types (tuple): Sequence types traversed, tuples are rebuilt as tuples.
+        max_depth (int): Levels of containers traversed, the values below them are not
+            transformed. None traverses all of them.
+    """
+
+    def __init__(self, key_rule = None, value_rules = (), in_place: bool = False,  # pylint: disable=too-many-arguments
+                 sequence_types: tuple = (list,), max_depth: Optional[int] = None):
+        self.key_rule = key_rule
+        self.value_rules = tuple(value_rules)
+        self.in_place = in_place
+        self.sequence_types = tuple(sequence_types)
+        self.max_depth = max_depth
+        self._kinds = {}
+        self._rules = {}
+
+    def _kind_of(self, value_type) -> int:
+        """Classifies a type once: leaf, rule, mapping or sequence"""
+        kind = self._kinds.get(value_type)
+        if kind is None:
+            rule = next(
+                (function for types, function in self.value_rules if issubclass(value_type, types)),
+                None
+            )
+            if rule is not None:
+                kind = _RULE
+                self._rules[value_type] = rule
+            elif issubclass(value_type, dict):
+                kind = _MAPPING
+            elif issubclass(value_type, self.sequence_types):
+                kind = _SEQUENCE
+            else:
+                kind = _LEAF
+            self._kinds[value_type] = kind
+        return kind
+
+    def transform(self, data):
+        """
+        Applies the rules to the payload.
+
+        Args:
+            data (dict, list, or any): The payload.
+
+        Returns:
+            dict, list, or any: The transformed payload, the same object when `in_place` is set
+                and the root is a container.
+        """
+        kind = self._kind_of(type(data))
+        if kind == _RULE:
+            return self._rules[type(data)](data)
+        if kind == _LEAF or self.max_depth == 0:
+            return data
+        root = [data]
+        stack = [(data, root, 0, 0)]
+        while stack:
+            node, parent, slot, depth = stack.pop()
+            if node is _FINALIZE_TUPLE:
+                items, parent, slot = parent
+                parent[slot] = tuple(items)
+            elif isinstance(node, dict):
+                parent[slot] = self._visit_dict(node, depth, stack)
+            else:
+                self._visit_sequence(node, parent, slot, depth, stack)
+        return root[0]
+
+    def _visit_dict(self, node: dict, depth: int, stack: list) -> dict:
+        key_rule = self.key_rule
+        if self.in_place:
+            target = node
+            if key_rule is not None:
+                items = list(node.items())
+                node.clear()
+                for key, value in items:
+                    node[key_rule(key)] = value
+            items = list(node.items())
+        else:
+            target = {}
+            items = node.items()
+        kinds, rules = self._kinds, self._rules
+        child_depth = depth + 1
+        descend = self.max_depth is None or child_depth < self.max_depth
+        in_place = self.in_place
+        pending = []
+        for key, value in items:
+            if not in_place and key_rule is not None:
+                key = key_rule(key)
+            value_type = type(value)
+            kind = kinds.get(value_type)
+            if kind is None:
+                kind = self._kind_of(value_type)
+            if kind == _RULE:
+                value = rules[value_type](value)
+                if in_place:
+                    target[key] = value
+            elif kind != _LEAF and descend:
+                pending.append((key, value))
+            if not in_place:
+                target[key] = value
+        for key, value in pending:
+            # Keys renamed to the same name keep the last value, like a dict literal
+            if target[key] is value:
+                stack.append((value, target, key, child_depth))
+        return target
+
+    def _visit_sequence(self, node, parent, slot, depth: int, stack: list):
+        if isinstance(node, tuple):
+            target = list(node)
+            stack.append((_FINALIZE_TUPLE, (target, parent, slot), None, depth))
+        elif self.in_place:
+            target = node
+        else:
+            target = list(node)
+            parent[slot] = target
+        kinds, rules = self._kinds, self._rules
+        child_depth = depth + 1
+        descend = self.max_depth is None or child_depth < self.max_depth
+        rows = not self.in_place and (self.max_depth is None or child_depth + 1 < self.max_depth)
+        shapes = {}
+        for index, value in enumerate(target):
+            value_type = type(value)
+            kind = kinds.get(value_type)
+            if kind is None:
+                kind = self._kind_of(value_type)
+            if kind == _RULE:
+                target[index] = rules[value_type](value)
+            elif kind == _MAPPING and rows:
+                target[index] = self._visit_row(value, child_depth, stack, shapes)
+            elif kind != _LEAF and descend:
+                stack.append((value, target, index, child_depth))
+
+    def _visit_row(self, node: dict, depth: int, stack: list, shapes: dict) -> dict:
+        """
+        Copies a dict of a list. Lists of records repeat the same keys and value types, so the
+        renamed keys and the values needing work are computed once per shape and every row is
+        rebuilt with a zip.
+        """
+        keys = tuple(node)
+        values = list(node.values())
+        value_types = tuple(map(type, values))
+        shape = shapes.get((keys, value_types))
+        if shape is None:
+            key_rule = self.key_rule
+            new_keys = tuple(map(key_rule, keys)) if key_rule is not None else keys
+            plan = tuple(
+                (index, kind) for index, kind in enumerate(map(self._kind_of, value_types))
+                if kind != _LEAF
+            )
+            if len(shapes) >= _MAX_ROW_SHAPES:
+                shapes.clear()
+            shape = shapes[(keys, value_types)] = (new_keys, plan, len(set(new_keys)) == len(new_keys))
+        new_keys, plan, unique_keys = shape
+        rules = self._rules
+        for index, kind in plan:
+            if kind == _RULE:
+                values[index] = rules[value_types[index]](values[index])
+        row = dict(zip(new_keys, values))
+        for index, kind in plan:
+            if kind != _RULE and (unique_keys or row[new_keys[index]] is values[index]):
+                stack.append((values[index], row, new_keys[index], depth + 1))
+        return row
+
+    def to_json(self, data, default = None) -> str:
+        """
+        Transforms the payload and serializes it to a JSON string.
+
+        The C encoder of the json module is used, payloads nested deeper than it supports are
+        serialized by an iterative encoder with the same output.
+
+        Args:
+            data (dict, list, or any): The payload.
+            default (callable, optional): Function that serializes the unsupported values.
+
+        Returns:
+            str: The JSON document.
+        """
+        data = self.transform(data)
+        try:
+            return json.dumps(data, default=default)
+        except RecursionError:
+            logger.warning("Payload too deep for the json module, using the iterative encoder")
+            return iterative_json_dumps(data, default=default)
+
+
+_FINALIZE_TUPLE = object()
+_LEAF, _RULE, _MAPPING, _SEQUENCE = range(4)
+# Distinct row shapes remembered while a list is traversed
+_MAX_ROW_SHAPES = 64
+
+
+def iterative_json_dumps(data, default = None) -> str:
+    """
+    Serializes a payload to JSON like `json.dumps` with the default options, using an explicit
+    stack so the nesting depth is not limited by the recursion limit.
+
+    Args:
+        data (dict, list, or any): The payload.
+        default (callable, optional): Function that serializes the unsupported values.
+
+    Returns:
+        str: The JSON document.
+
+    Raises:
+        TypeError: When a value is not serializable and there is no default.
+    """
+    encode_string = json.encoder.encode_basestring_ascii
+    chunks = []
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, _JsonToken):
+            chunks.append(node.text)
+        elif isinstance(node, str):
+            chunks.append(encode_string(node))
+        elif node is None:
+            chunks.append('null')
+        elif node is True:
+            chunks.append('true')
+        elif node is False:
+            chunks.append('false')
+        elif isinstance(node, int):
+            chunks.append(int.__repr__(node))
+        elif isinstance(node, float):
+            chunks.append(_float_to_json(node))
+        elif isinstance(node, dict):
+            # Pushed in reverse so the items are popped in order
+            stack.append(_JSON_OBJECT_END)
+            for position, (key, value) in enumerate(reversed(list(node.items()))):
+                stack.append(value)
+                stack.append(_JsonToken(
+                    _json_key(key, encode_string) + ': '
+                    if position == len(node) - 1 else
+                    ', ' + _json_key(key, encode_string) + ': '
+                ))
+            chunks.append('{')
+        elif isinstance(node, (list, tuple)):
+            stack.append(_JSON_ARRAY_END)
+            for position, value in enumerate(reversed(node)):
+                stack.append(value)
+                if position != len(node) - 1:
+                    stack.append(_JSON_SEPARATOR)
+            chunks.append('[')
+        elif default is not None:
+            stack.append(default(node))
+        else:
+            raise TypeError(f'Object of type {type(node).__name__} is not JSON serializable')
+    return ''.join(chunks)
+
+
+class _JsonToken:
+    """Literal text of the iterative encoder"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+_JSON_OBJECT_END = _JsonToken('}')
+_JSON_ARRAY_END = _JsonToken(']')
+_JSON_SEPARATOR = _JsonToken(', ')
+
+
+def _json_key(key, encode_string) -> str:
+    if isinstance(key, str):
+        return encode_string(key)
+    if key is True:
+        return '"true"'
+    if key is False:
+        return '"false"'
+    if key is None:
+        return '"null"'
+    if isinstance(key, float):
+        return '"' + _float_to_json(key) + '"'
+    if isinstance(key, int):
+        return '"' + int.__repr__(key) + '"'
+    raise TypeError(f'keys must be str, int, float, bool or None, not {type(key).__name__}')
+
+
+def _float_to_json(value: float) -> str:
+    if value != value:  # pylint: disable=comparison-with-itself
+        return 'NaN'
+    if value == float('inf'):
+        return 'Infinity'
+    if value == -float('inf'):
+        return '-Infinity'
+    return float.__repr__(value)
+
+
+def _clean_string(value: str) -> str:
+    return re.sub(r'\s+', ' ', value).strip()
+
+
+def _bytes_to_base64(value: bytes) -> str:
+    return base64.b64encode(value).decode('utf-8')
+
+
+@functools.lru_cache(maxsize=KEY_CACHE_SIZE)
+def _upper_init_char(key: str) -> str:
+    return key[0].upper() + key[1:]
+
+
+class JsonBackend:
+    """
+    Serializes response bodies to JSON, including the values the json module does not support:
+    Decimal (as float, or as string to keep every digit), datetime and date (ISO 8601 or
+    `datetime_format`) and bytes (base64).
+
+    Attributes:
+        name (str): Name of the backend.
+        decimal_mode (str): `float` or `str`.
+        datetime_format (str): strftime format of the datetime values, ISO 8601 when empty.
+        camel_case_normalizer (ResponseNormalizer): Renames the keys to camel case and converts
+            the values the encoder does not support in the same traversal.
+    """
+    name = 'stdlib'
+
+    def __init__(self, decimal_mode: str = 'float', datetime_format: str = ''):
+        if decimal_mode not in ('float', 'str'):
+            raise ValueError(f'Invalid decimal mode: {decimal_mode}')
+        self.decimal_mode = decimal_mode
+        self.datetime_format = datetime_format
+        self.camel_case_normalizer = ResponseNormalizer(
+            key_rule=camel_case_key, value_rules=[(self.converted_types(), self.default)],
+            sequence_types=(list, tuple)
+        )
+
+    def converted_types(self) -> tuple:
+        """Returns the types the encoder hands to `default`"""
+        return (decimal.Decimal, datetime.date, datetime.time, bytes, bytearray)
+
+    def default(self, value):
+        """
+        Converts a value the encoder does not support.
+
+        Args:
+            value (object): The value.
+
+        Returns:
+            The JSON serializable value.
+
+        Raises:
+            TypeError: When the value is not supported.
+        """
+        if isinstance(value, decimal.Decimal):
+            return float(value) if self.decimal_mode == 'float' else str(value)
+        if isinstance(value, datetime.datetime) and self.datetime_format:
+            return value.strftime(self.datetime_format)
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        if isinstance(value, (bytes, bytearray)):
+            return base64.b64encode(value).decode('utf-8')
+        raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+    def dumps(self, data) -> str:
+        """
+        Serializes the data with the separators and escaping of `json.dumps`, the output of
+        payloads `json.dumps` supports is the same byte for byte.
+
+        Args:
+            data (Any): The payload.
+
+        Returns:
+            str: The JSON document.
+        """
+        return json.dumps(data, default=self.default)
+
+
+class OrjsonBackend(JsonBackend):
+    """
+    JsonBackend over orjson, several times faster on large payloads. The output is compact and
+    UTF-8 instead of ASCII escaped, and NaN and Infinity are written as null.
+    """
+    name = 'orjson'
+
+    def __init__(self, decimal_mode: str = 'float', datetime_format: str = ''):
+        super().__init__(decimal_mode, datetime_format)
+        self.options = orjson.OPT_NON_STR_KEYS
+        if datetime_format:
+            self.options |= orjson.OPT_PASSTHROUGH_DATETIME
+
+    def converted_types(self) -> tuple:
+        if self.datetime_format:
+            return (decimal.Decimal, datetime.datetime, bytes, bytearray)
+        return (decimal.Decimal, bytes, bytearray)
+
+    def dumps(self, data) -> str:
+        return orjson.dumps(data, default=self.default, option=self.options).decode('utf-8')
+
+
+__JSON_BACKEND = None
+
+
+def create_json_backend(name: str = 'stdlib', decimal_mode: str = 'float', datetime_format: str = '') -> JsonBackend:
+    """
+    Creates a JSON backend.
+
+    Args:
+        name (str): `stdlib` (compatible with `json.dumps`), `orjson`, or `auto` to use orjson
+            when it is installed.
+        decimal_mode (str): `float` or `str`.
+        datetime_format (str): strftime format of the datetime values, ISO 8601 when empty.
+
+    Returns:
+        JsonBackend: The backend, stdlib when orjson is requested and not installed.
+    """
+    if name in ('orjson', 'auto'):
+        if orjson is not None:
+            return OrjsonBackend(decimal_mode, datetime_format)
+        if name == 'orjson':
+            logger.warning("orjson is not installed, using the stdlib json backend")
+    elif name != 'stdlib':
+        raise ValueError(f'Invalid JSON backend: {name}')
+    return JsonBackend(decimal_mode, datetime_format)
+
+
+def get_json_backend() -> JsonBackend:
+    """
+    Returns the JSON backend of the container, configured with `JSON_BACKEND`, `JSON_DECIMAL_MODE`
+    and `JSON_DATETIME_FORMAT`.
+
+    Returns:
+        JsonBackend: The shared backend.
+    """
+    global __JSON_BACKEND  # pylint: disable=global-statement
+    if __JSON_BACKEND is None:
+        __JSON_BACKEND = create_json_backend(
+            os.environ.get('JSON_BACKEND', 'stdlib'),
+            os.environ.get('JSON_DECIMAL_MODE', 'float'),
+            os.environ.get('JSON_DATETIME_FORMAT', '')
+        )
+    return __JSON_BACKEND
+
+
+def compute_etag(content: str) -> str:
+    """
+    Computes the ETag of a serialized body or of a version token. It is weak because API Gateway
+    compresses the body for the clients that accept it, so the bytes sent are not always the ones
+    hashed.
+
+    Args:
+        content (str): The body or the token.
+
+    Returns:
+        str: The quoted weak ETag.
+    """
+    return 'W/"' + hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Compares an ETag with the `If-None-Match` of a request using the weak comparison.
+
+    Args:
+        if_none_match (str): The `If-None-Match` header, a list of ETags or `*`.
+        etag (str): The ETag of the current representation.
+
+    Returns:
+        bool: Whether the client already has the representation.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith('W/') else candidate) == opaque:
+            return True
+    return False
+
+
+def not_modified_response(headers: dict, etag: str) -> dict:
+    """
+    Builds the bodiless 304 answered when the client has the current representation.
+
+    Args:
+        headers (dict): Headers of the response.
+        etag (str): The ETag of the representation.
+
+    Returns:
+        dict: The 304 response.
+    """
+    logger.debug("Not modified, ETag %s", etag)
+    headers = {key: value for key, value in headers.items() if key != 'Content-Type'}
+    headers.update({'ETag': etag, 'Vary': 'Accept-Encoding'})
+    return {'headers': headers, 'statusCode': 304, 'body': ''}
+
+
+def get_request_header(event: Optional[dict], name: str) -> Optional[str]:
+    """
+    Returns a header of an API Gateway event, the header names are case insensitive.
+
+    Args:
+        event (dict): The API Gateway event.
+        name (str): Name of the header.
+
+    Returns:
+        str: The value of the header, the values joined with commas when it is repeated, None
+            when it is missing.
+    """
+    name = name.lower()
+    for header, values in ((event or {}).get('multiValueHeaders') or {}).items():
+        if header.lower() == name and values:
+            return ', '.join(values)
+    for header, value in ((event or {}).get('headers') or {}).items():
+        if header.lower() == name:
+            return value
+    return None
+
+
+def _fits_response_limit(response: dict) -> bool:
+    # The body is escaped again when the response is serialized, measure it only when it matters
+    if len(response['body']) * 2 < LAMBDA_RESPONSE_LIMIT:
+        return True
+    return len(json.dumps(response).encode('utf-8')) <= LAMBDA_RESPONSE_LIMIT
+
+
+def _response_too_large(response: dict) -> dict:
+    size = len(response['body'].encode('utf-8'))
+    if _offload_configuration() is not None:
+        offloaded = offload_response(response)
+        if offloaded is not response:
+            return offloaded
+    logger.error("Response of %s bytes exceeds the Lambda response limit", size)
+    return return_formatted_response(None, 500, {}, f'Response of {size} bytes exceeds the response limit')
+
+
+def _offload_configuration():
+    """Returns the configuration when `RESPONSE_OFFLOAD_BUCKET` is set, without importing boto3 nor
+    reading the configuration otherwise"""
+    if not os.environ.get('RESPONSE_OFFLOAD_BUCKET'):
+        return None
+    # pylint: disable-next=import-outside-toplevel
+    from .utils_aws import get_configuration
+    return get_configuration()
+
+
+def estimate_json_size(data, depth: int = 2) -> int:
+    """
+    Estimates the size of the JSON document of a payload without serializing all of it: lists
+    longer than `SIZE_ESTIMATE_SAMPLES` are extrapolated from evenly spaced items, and containers
+    deeper than `depth` are serialized as they are.
+
+    Args:
+        data (dict, list, or any): The payload.
+        depth (int): Levels of containers walked before serializing.
+
+    Returns:
+        int: The estimated size in characters.
+    """
+    if isinstance(data, list) and len(data) > SIZE_ESTIMATE_SAMPLES:
+        step = len(data) // SIZE_ESTIMATE_SAMPLES
+        sample = data[::step][:SIZE_ESTIMATE_SAMPLES]
+        return estimate_json_size(sample, depth) * len(data) // len(sample)
+    if depth > 0 and isinstance(data, dict):
+        return 2 + sum(len(str(key)) + 6 + estimate_json_size(value, depth - 1) for key, value in data.items())
+    if depth > 0 and isinstance(data, list):
+        return 2 + sum(2 + estimate_json_size(item, depth - 1) for item in data)
+    return len(get_json_backend().dumps(data))
+
+
+def offload_payload(body: bytes, content_type: str = 'application/json') -> Optional[dict]:
+    """
+    Uploads a serialized payload to `RESPONSE_OFFLOAD_BUCKET` under `RESPONSE_OFFLOAD_PREFIX`,
+    the bucket is expected to expire the objects with a lifecycle rule.
+
+    Args:
+        body (bytes): The payload.
+        content_type (str): Content type of the payload.
+
+    Returns:
+        dict: Pointer with the bucket, key and size of the object, None when the upload failed.
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from .utils_aws import get_configuration, upload_to_s3
+    configuration = get_configuration()
+    key = f'{configuration.response_offload_prefix}{uuid.uuid4().hex}.json'
+    if not upload_to_s3(configuration.response_offload_bucket, key, body, content_type):
+        return None
+    logger.info("Payload of %s bytes offloaded to s3://%s/%s", len(body), configuration.response_offload_bucket, key)
+    return {'bucket': configuration.response_offload_bucket, 'key': key, 'size': len(body)}
+
+
+def offload_response(response: dict) -> dict:
+    """
+    Uploads the body of an API Gateway proxy response to S3 and replaces it with an envelope
+    whose `offload` has a presigned GET url valid for `RESPONSE_OFFLOAD_URL_TTL` seconds. The
+    url returns the original body. The envelope is sent with `Cache-Control: no-store` and
+    without ETag, a client must not revalidate it once the url expired.
+
+    Args:
+        response (dict): The response, with a str body.
+
+    Returns:
+        dict: The response with the envelope, the same response when the upload failed.
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from .utils_aws import generate_presigned_url, get_configuration
+    body = response['body'].encode('utf-8')
+    pointer = offload_payload(body, response['headers'].get('Content-Type', 'application/json'))
+    if pointer is None:
+        return response
+    expires_in = get_configuration().response_offload_url_ttl
+    url = generate_presigned_url(pointer['bucket'], pointer['key'], expires_in)
+    if url is None:
+        return response
+    status = response['statusCode']
+    envelope = {
+        'status': status,
+        'message': RESPONSE_CODES.get(status, 'Internal Server Error') + ' offloaded',
+        'data': None,
+        'offload': {'url': url, 'expiresIn': expires_in, 'size': pointer['size']},
+    }
+    headers = {key: value for key, value in response['headers'].items() if key != 'ETag'}
+    headers['Cache-Control'] = 'no-store'
+    return {**response, 'headers': headers, 'body': get_json_backend().dumps(envelope)}
+
+
+def load_offloaded_payload(response: Any) -> Any:
+    """
+    Returns the response offloaded by `return_formatted_response_stepfunction`, reading it from
+    S3 only when the response is an offload pointer.
+
+    Args:
+        response (Any): The response of the step, usually the input of the next one.
+
+    Returns:
+        Any: The original response, the same response when it was not offloaded.
+
+    Raises:
+        ClientError: When the offloaded object can not be read.
+    """
+    if not isinstance(response, dict) or not isinstance(response.get('offload'), dict):
+        return response
+    # pylint: disable-next=import-outside-toplevel
+    from .utils_aws import read_s3_object
+    pointer = response['offload']
+    logger.info("Loading offloaded payload s3://%s/%s", pointer['bucket'], pointer['key'])
+    return json.loads(read_s3_object(pointer['bucket'], pointer['key']))
+
+
+CAMEL_CASE_NORMALIZER = ResponseNormalizer(key_rule=camel_case_key)
+UPPER_INIT_CHAR_NORMALIZER = ResponseNormalizer(key_rule=_upper_init_char)
+PASCAL_CASE_KEYS_NORMALIZER = ResponseNormalizer(key_rule=camel_to_pascal, max_depth=1)
+CLEAN_STRINGS_NORMALIZER = ResponseNormalizer(
+    value_rules=[(str, _clean_string)], in_place=True, sequence_types=()
+)
+BYTES_TO_BASE64_NORMALIZER = ResponseNormalizer(
+    value_rules=[(bytes, _bytes_to_base64)], in_place=True, sequence_types=()
+)
@@ -0,0 +1,86 @@
+"""
+Utils to coalesce identical concurrent calls, the first caller of a key runs the call and the
+callers arriving while it is in flight wait and share its result or exception.
+"""
+import threading
+from typing import Any, Callable, Hashable
+
+from .logger_config import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class _Call:
+    """A call in flight"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Group of calls coalesced by key. Results are shared, callers must not mutate them.
+
+    Attributes:
+        calls (int): Number of calls executed.
+        shared (int): Number of callers that received the result of another caller.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.shared = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable, *args, **kwargs) -> Any:
+        """
+        Runs `function(*args, **kwargs)` unless a call with the same key is in flight, in which
+        case it waits for that call.
+
+        Args:
+            key (Hashable): Identity of the call.
+            function (Callable): The call.
+            *args: Arguments of the call.
+            **kwargs: Keyword arguments of the call.
+
+        Returns:
+            Any: The result of the call.
+
+        Raises:
+            Exception: The exception raised by the call.
+        """
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function(*args, **kwargs)
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        """
+        Returns the counters of the group.
+
+        Returns:
+            dict: calls, shared and in_flight.
+        """
+        with self._lock:
+            return {'calls': self.calls, 'shared': self.shared, 'in_flight': len(self._in_flight)}
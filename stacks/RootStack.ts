@@ -15,6 +15,8 @@ export async function RootStack(stack: cdk.Stack) {
           defaultCorsPreflightOptions: {
             allowOrigins: ['"*"'],
           },
+          // API Gateway gzips the responses of the clients that accept it
+          minimumCompressionSize: Number(process.env.API_MINIMUM_COMPRESSION_SIZE || 1024),
         },
       },
     });
@@ -4,6 +4,7 @@ import {ResourceNestedStackProps} from "./Stacksinterface"
 import {Construct} from 'constructs';
 import {Method} from "aws-cdk-lib/aws-apigateway";
 import * as lambda from 'aws-cdk-lib/aws-lambda';
+import * as iam from "aws-cdk-lib/aws-iam";
 import {DeployStack} from "./DeployStacks";
 import {rolesPermissionsMapper} from './rolesPermissions';
 import {createRoles} from "./lambdaResources";
@@ -33,6 +34,8 @@ export class CommonStack extends NestedStack {
             process.env.BASE_API_REST_KEYCLOAK || ""
         );
         const realm_keycloak = String(process.env.REALM_KEYCLOAK || "");
+        const keycloak_validation_mode = String(process.env.KEYCLOAK_VALIDATION_MODE || "userinfo");
+        const keycloak_audience = String(process.env.KEYCLOAK_AUDIENCE || "");
         const insights_enabled = String(process.env.INSIGHTS_ENABLED)
         const contactTableEnv = String(process.env.HERMES2_CONTACT_TABLE_ENV)
         const baseUrlElastichSearchCustomer = String(process.env.BASE_URL_ELASTICSEARCH_SEARCH_CUSTOMER)
@@ -43,6 +46,8 @@ export class CommonStack extends NestedStack {
             ACCESS_CONTROL_ALLOW_ORIGIN: access_allow_origin,
             BASE_API_REST_KEYCLOAK: base_api_rest_keycloak,
             REALM_KEYCLOAK: realm_keycloak,
+            KEYCLOAK_VALIDATION_MODE: keycloak_validation_mode,
+            KEYCLOAK_AUDIENCE: keycloak_audience,
             ENVIRONMENT_VAR: environment_var,
             HERMES2_CONTACT_TABLE_ENV: contactTableEnv,
             BASE_URL_ELASTICSEARCH_SEARCH_CUSTOMER: baseUrlElastichSearchCustomer
@@ -59,6 +64,10 @@ export class CommonStack extends NestedStack {
                 rootResourceId: props.rootResourceId,
         });
 
+        const permissionsMapper = rolesPermissionsMapper()
+        //Roles
+        const roleL = createRoles(this, "roleL", stageName, permissionsMapper.get("L"))
+
         const lambdaFunctionAuthorizer = new lambda.Function(this, stageName + "-AuthorizerFunction", {
             runtime: props.lambdaRuntime,
             handler: "api_gateway_authorizer.authorizer",
@@ -85,15 +94,17 @@ export class CommonStack extends NestedStack {
 
 
 
-        const permissionsMapper = rolesPermissionsMapper()
-        //Roles
-        const roleC = createRoles(this, "roleC", stageName, permissionsMapper.get("C"))
 
 
         const envVarsCompliace = returnEnvVariables(['LEGACY_FRONT_OFFICE1', 'LEGACY_FRONT_OFFICE2',
             'ACCESS_CONTROL_ALLOW_ORIGIN','ENVIRONMENT_VAR',
             'BASE_API_REST_HERMES1', 'TTL_DYNAMO_RECORDS']);
 
+        envVarsCompliace['SOAP_PREWARM_VERSIONS'] = String(process.env.SOAP_PREWARM_VERSIONS || "1");
+        envVarsCompliace['LEGACY_CACHED_OPERATIONS'] = String(process.env.LEGACY_CACHED_OPERATIONS || "GetGlobalAttribute:3600:300");
+        envVarsCompliace['LEGACY_RESPONSE_CACHE_TABLE'] = String(process.env.LEGACY_RESPONSE_CACHE_TABLE || "");
+        envVarsCompliace['RESPONSE_OFFLOAD_BUCKET'] = String(process.env.RESPONSE_OFFLOAD_BUCKET || "");
+
             const new_props =  {...props};
             new_props.layers= [ utilsLayer, authenticationLayer, zeepLayer];
 
@@ -102,12 +113,42 @@ export class CommonStack extends NestedStack {
                this, api, "TestSentry",
                "sentry.test",
                "services/functions/handlers/sentry",
-               stageName, envVarsCompliace, roleC, logGroup, new_props
+               stageName, envVarsCompliace, roleL, logGroup, new_props
          );
 
         const resource = addResourceApiGateway(api, 'test')
         addLambdaFunctionsIntegration(this, resource, 'GET', false, lambdaFunction, authorizer, {})
 
+        // Keeps SESSION_LOOKUP_TABLE (get_item session lookup mode) in sync with users-sessions
+        const session_lookup_table = String(process.env.SESSION_LOOKUP_TABLE || "");
+        const session_stream_arn = String(process.env.SESSION_LOOKUP_STREAM_ARN || "");
+        if (session_lookup_table && session_stream_arn) {
+            const roleSessionSync = createRoles(this, "roleSessionSync", stageName, [
+                {name: "dynamodb", accessLevel: "", tableName: []}
+            ]);
+            roleSessionSync.addToPolicy(new iam.PolicyStatement({
+                actions: ["dynamodb:DescribeStream", "dynamodb:GetRecords", "dynamodb:GetShardIterator", "dynamodb:ListStreams"],
+                resources: [session_stream_arn],
+            }));
+            const sessionSyncFunction = new lambda.Function(this, stageName + "-SessionLookupSync", {
+                runtime: props.lambdaRuntime,
+                handler: "session_lookup_sync.handler",
+                environment: {...environment, SESSION_LOOKUP_TABLE: session_lookup_table},
+                code: lambda.Code.fromAsset("services/functions/handlers/sentry"),
+                layers: [utilsLayer, authenticationLayer],
+                role: roleSessionSync,
+                timeout: Duration.seconds(60),
+                logGroup : logGroup,
+            });
+            new lambda.EventSourceMapping(this, stageName + "-SessionLookupSyncMapping", {
+                target: sessionSyncFunction,
+                eventSourceArn: session_stream_arn,
+                startingPosition: lambda.StartingPosition.TRIM_HORIZON,
+                batchSize: 100,
+                retryAttempts: 10,
+            });
+        }
+
 
 
 
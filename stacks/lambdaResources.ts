@@ -70,6 +70,9 @@ export function createRoles(stack: any, domainName: string, stageName: string, p
         } else if (permission.name == "s3") {
             if (permission.accessLevel == "read") {
                 actions.push("s3:GetObject");
+            } else if (permission.accessLevel == "write") {
+                actions.push("s3:GetObject");
+                actions.push("s3:PutObject");
             } else {
                 actions.push("s3:GetObject");
                 actions.push("s3:PutObject");
@@ -30,6 +30,18 @@ export function rolesPermissionsMapper() {
             parameterName: []
         }
     ];
+    // roleC plus read/write on the bucket of the offloaded responses, for the functions that
+    // serialize responses (not the authorizer)
+    const responseOffloadBucket = String(process.env.RESPONSE_OFFLOAD_BUCKET || "");
+    const roleLPermissions: any[] = [
+        ...roleCPermissions,
+        ...(responseOffloadBucket ? [{
+            name: "s3",
+            accessLevel: "write",
+            bucket: [responseOffloadBucket],
+            parameterName: []
+        }] : [])
+    ];
     const roleDPermissions: any[] = [
         {
             name: "dynamodb",
@@ -204,6 +216,7 @@ export function rolesPermissionsMapper() {
     permissionsMapper.set("H", roleHPermissions)
     permissionsMapper.set("I", roleIPermissions)
     permissionsMapper.set("K", roleKPermissions)
+    permissionsMapper.set("L", roleLPermissions)
 
     return permissionsMapper
 